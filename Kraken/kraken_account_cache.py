@@ -0,0 +1,144 @@
+import threading
+import time
+from concurrent.futures import Future
+from kraken_api_acct_mgt import KrakenAPIAcctMgt
+
+# Time in seconds a response is reused, for each KrakenAPIAcctMgt method
+DEFAULT_TTLS = {
+    "get_balance": 5.0,
+    "get_extended_balance": 5.0,
+    "get_trade_orders": 5.0,
+    "get_open_orders": 2.0,
+    "get_open_positions": 5.0,
+}
+
+# The state changed by placing an order: the open orders, the balances (filled at once by a market order,
+# held by a limit order in BalanceEx), the trade balance and the positions (opened by a margin order)
+ORDER_EVENT_METHODS = ("get_open_orders", "get_balance", "get_extended_balance", "get_trade_orders",
+                       "get_open_positions")
+
+
+class KrakenAccountStateCache:
+    """
+    A cache of the account state around KrakenAPIAcctMgt.
+
+    Each response is reused until its TTL expires, and the identical requests made while one is in
+    flight wait for its response instead of being sent again. KrakenOrderManager invalidates the cache
+    when it places an order, so the next reads get the new state. Responses with errors are not cached.
+
+    Attributes:
+        acct_mgt (KrakenAPIAcctMgt): The client used to request the account state.
+        ttls (dict): The TTL in seconds of each method, 0 disables the cache of a method.
+        hits (int): Number of calls answered from the cache or by a request in flight.
+        misses (int): Number of requests sent.
+
+    Methods:
+        get_balance() / get_extended_balance() / get_trade_orders(asset) / get_open_orders(trades_bool) /
+        get_open_positions():
+            Same as the methods of KrakenAPIAcctMgt, through the cache.
+
+        invalidate(methods):
+            Drops the cached responses of some methods, or of all of them.
+    """
+    def __init__(self, acct_mgt=None, ttls=None):
+        """
+        Initializes the KrakenAccountStateCache class.
+
+        Parameters:
+            acct_mgt (KrakenAPIAcctMgt, optional): The client used to request the account state. Default is a new one.
+            ttls (dict, optional): The TTL in seconds of some methods, e.g. {"get_open_orders": 1}, the other
+                                   methods keep the DEFAULT_TTLS.
+        """
+        self.acct_mgt = acct_mgt if acct_mgt is not None else KrakenAPIAcctMgt()
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._in_flight = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def _get(self, method, *args):
+        """
+        Returns the response of a KrakenAPIAcctMgt method, from the cache if it has not expired.
+        """
+        key = (method,) + args
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.hits += 1
+                is_leader = False
+            else:
+                self.misses += 1
+                is_leader = True
+                future = self._in_flight[key] = Future()
+                generation = self._generations.get(method, 0)
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            response = getattr(self.acct_mgt, method)(*args)
+        except BaseException as e:
+            with self._lock:
+                if self._in_flight.get(key) is future:
+                    del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+            # A response requested before an invalidation may already be stale, it is not cached
+            ttl = self.ttls.get(method, 0)
+            if ttl > 0 and not response.get("error") and self._generations.get(method, 0) == generation:
+                self._entries[key] = (time.monotonic() + ttl, response)
+        future.set_result(response)
+        return response
+
+    def invalidate(self, methods=None):
+        """
+        Drops the cached responses of some methods, so that the next calls request the account state again.
+
+        Parameters:
+            methods (iterable, optional): The names of the methods, e.g. ["get_balance"]. Default is all of them.
+        """
+        with self._lock:
+            methods = set(self.ttls if methods is None else methods)
+            for method in methods:
+                self._generations[method] = self._generations.get(method, 0) + 1
+            # The requests in flight are left to their callers, the next calls send new ones
+            for cache in (self._entries, self._in_flight):
+                for key in [key for key in cache if key[0] in methods]:
+                    del cache[key]
+
+    def get_balance(self):
+        return self._get("get_balance")
+
+    def get_extended_balance(self):
+        return self._get("get_extended_balance")
+
+    def get_trade_orders(self, asset):
+        return self._get("get_trade_orders", asset)
+
+    def get_open_orders(self, trades_bool):
+        return self._get("get_open_orders", trades_bool)
+
+    def get_open_positions(self):
+        return self._get("get_open_positions")
+
+
+if __name__ == "__main__":
+    from concurrent.futures import ThreadPoolExecutor
+
+    account = KrakenAccountStateCache()
+
+    # 20 concurrent reads of the balance send a single request
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        responses = list(executor.map(lambda _: account.get_balance(), range(20)))
+    print(responses[0])
+    print(f"hits: {account.hits}, requests sent: {account.misses}")
@@ -1,22 +1,28 @@
-import requests
 import time
-import hashlib
-import hmac
-import base64
 import urllib.parse
-import pandas as pd
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from kraken_http import get_default_transport
+from kraken_order_cache import KrakenOrderCache
+from kraken_signer import get_default_signer, load_api_keys
 
-def load_api_keys():
+
+def _page_parameters(ofs, start, end):
     """
-    Loads API keys from a file called 'keys.txt'.
+    Builds the paging parameters of the history endpoints, which return 50 results per page.
+
+    Args:
+        ofs (int): The offset of the first result.
+        start (float or str): Exclusive starting timestamp or transaction ID of the results.
+        end (float or str): Inclusive ending timestamp or transaction ID of the results.
 
     Returns:
-        tuple: A tuple containing the API key and API secret.
+        dict: The parameters that are not None.
     """
-    with open('keys.txt', 'r') as file:
-        keys = file.read().splitlines()
-    return keys[0], keys[1]
+    parameters = {"ofs": ofs, "start": start, "end": end}
+    return {key: value for key, value in parameters.items() if value is not None}
+
+# Maximum number of txids of a QueryOrders request
+QUERY_ORDERS_MAX_TXIDS = 50
 
 class KrakenAPIAcctMgt: 
     """
@@ -26,6 +32,9 @@ class KrakenAPIAcctMgt:
         api_url (str): The base URL for the Kraken API.
         api_key (str): The API key used for authentication.
         api_sec (str): The API secret used for signing requests.
+        transport (KrakenTransport): The pooled HTTP transport used to send the requests.
+        signer (KrakenSigner): The signer holding the decoded API secret, shared by all the clients.
+        order_cache (KrakenOrderCache): The persistent cache of the closed and canceled orders.
 
     Methods:
         get_kraken_signature(urlpath, data):
@@ -46,45 +55,57 @@ class KrakenAPIAcctMgt:
         get_open_orders(trades_bool):
             Retrieves the user's open orders from the Kraken API.
 
-        get_closed_orders():
-            Retrieves the user's closed orders from the Kraken API.
+        get_closed_orders(ofs, start, end):
+            Retrieves one page of the user's closed orders from the Kraken API.
 
         query_orders_info(txid):
             Queries information about specific transaction IDs from the Kraken API.
 
-        get_trades_history():
-            Retrieves the user's trade history from the Kraken API.
+        query_orders(txids, max_workers):
+            Queries information about any number of transaction IDs, using the order cache.
+
+        get_trades_history(ofs, start, end):
+            Retrieves one page of the user's trade history from the Kraken API.
 
         get_open_positions():
             Retrieves the user's open positions from the Kraken API.
     """
-    def __init__(self):
+    def __init__(self, transport=None, signer=None, order_cache=None):
         """
         Initializes the KrakenAPIAcctMgt class.
 
         It sets the default values for the base URL, API key, and API secret.
-        """
-        self.api_url = "https://api.kraken.com"
-        self.api_key = load_api_keys()[0]
-        self.api_sec = load_api_keys()[1]
 
-    def get_kraken_signature(self, urlpath, data):
+        Parameters:
+            transport (KrakenTransport, optional): The HTTP transport to use. Default is the transport
+                                                   shared by all the Kraken clients.
+            signer (KrakenSigner, optional): The signer to use. Default is the signer shared by all the
+                                             Kraken clients, with the keys from 'keys.txt'.
+            order_cache (KrakenOrderCache, optional): The cache of the closed and canceled orders. Default is
+                                                      'Kraken_Store/orders_cache.sqlite'.
+        """
+        self.transport = transport if transport is not None else get_default_transport()
+        self.api_url = self.transport.base_url
+        self.signer = signer if signer is not None else get_default_signer()
+        self.api_key = self.signer.api_key
+        self.api_sec = self.signer.api_sec
+        self.order_cache = order_cache if order_cache is not None else KrakenOrderCache()
+
+    def get_kraken_signature(self, urlpath, data, postdata=None):
         """
         Generates the signature for a Kraken API request.
 
         Args:
             urlpath (str): The API endpoint URL path.
             data (dict): The request data parameters.
+            postdata (str, optional): The encoded body of the request, when it is not form-encoded (e.g. JSON).
 
         Returns:
             str: The generated signature as a base64-encoded string.
         """
-        postdata = urllib.parse.urlencode(data)
-        encoded = (str(data['nonce']) + postdata).encode()
-        message = urlpath.encode() + hashlib.sha256(encoded).digest()
-        mac = hmac.new(base64.b64decode(self.api_sec), message, hashlib.sha512)
-        sigdigest = base64.b64encode(mac.digest())
-        return sigdigest.decode()
+        if postdata is None:
+            postdata = urllib.parse.urlencode(data)
+        return self.signer.sign(urlpath, data['nonce'], postdata)
 
     def kraken_request(self, uri_path, data):
         """
@@ -97,12 +118,12 @@ class KrakenAPIAcctMgt:
         Returns:
             dict: The JSON response from the Kraken API.
         """
-        headers = {}
-        headers['API-Key'] = self.api_key
-        data['nonce'] = str(int(1000 * time.time()))
-        headers['API-Sign'] = self.get_kraken_signature(uri_path, data)
-        req = requests.post((self.api_url + uri_path), headers=headers, data=data)
+        # The nonce is taken once the rate limiter lets the request through
+        data.pop('nonce', None)
+        req = self.transport.post(uri_path, sign=lambda: self.signer.sign_request(uri_path, data))
+        start = time.perf_counter_ns()
         response = req.json()
+        self.transport.recorder.record(uri_path, "decode", start)
         return response
 
     def get_balance(self):
@@ -119,15 +140,54 @@ class KrakenAPIAcctMgt:
         data = {"trades": trades_bool}
         return self.kraken_request('/0/private/OpenOrders', data)
 
-    def get_closed_orders(self):
-        return self.kraken_request('/0/private/ClosedOrders', {})
+    def get_closed_orders(self, ofs=None, start=None, end=None):
+        data = _page_parameters(ofs, start, end)
+        return self.kraken_request('/0/private/ClosedOrders', data)
 
     def query_orders_info(self, txid):
         data = {"txid": txid, "trades": True}
         return self.kraken_request('/0/private/QueryOrders', data)
 
-    def get_trades_history(self):
-        return self.kraken_request('/0/private/TradesHistory', {})
+    def query_orders(self, txids, max_workers=1):
+        """
+        Queries information about any number of transaction IDs.
+
+        The orders already closed or canceled are read from the order cache. The other txids are split into
+        requests of 50 txids, and the orders which are now closed or canceled are added to the cache.
+
+        Args:
+            txids (list or str): The transaction IDs, as a list or a comma delimited string.
+            max_workers (int, optional): Maximum number of requests sent in parallel. Default is 1: concurrent
+                                         requests may reach Kraken out of the order of their nonces, so only
+                                         raise it when a nonce window is set on the API key.
+
+        Returns:
+            dict: The response in the format of QueryOrders, with the errors of all the requests.
+        """
+        if isinstance(txids, str):
+            txids = txids.split(",")
+        txids = list(dict.fromkeys(txid.strip() for txid in txids if txid.strip()))
+        orders = self.order_cache.get_many(txids)
+        missing = [txid for txid in txids if txid not in orders]
+        chunks = [missing[i:i + QUERY_ORDERS_MAX_TXIDS] for i in range(0, len(missing), QUERY_ORDERS_MAX_TXIDS)]
+
+        errors = []
+        if chunks:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+                responses = executor.map(lambda chunk: self.query_orders_info(",".join(chunk)), chunks)
+                for response in responses:
+                    errors.extend(response.get("error", []))
+                    result = response.get("result") or {}
+                    self.order_cache.put_many(result)
+                    orders.update(result)
+
+        # The orders are returned in the order of the txids
+        result = {txid: orders[txid] for txid in txids if txid in orders}
+        return {"error": errors, "result": result}
+
+    def get_trades_history(self, ofs=None, start=None, end=None):
+        data = _page_parameters(ofs, start, end)
+        return self.kraken_request('/0/private/TradesHistory', data)
 
     def get_open_positions(self):
         data = {"docalcs": True}
@@ -168,6 +228,11 @@ if __name__ == "__main__":
     print("\nQuery Orders Info:")
     print(resp)
 
+    # Any number of txids can be queried, the closed and canceled orders are cached
+    resp = kraken_api.query_orders(txid.split(","))
+    print("\nQuery Orders:")
+    print(resp)
+
     resp = kraken_api.get_trades_history()
     print("\nGet Trades History:")
     print(resp)
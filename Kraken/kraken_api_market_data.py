@@ -1,33 +1,45 @@
 import requests
 import time
-import pandas as pd
-from kraken_api_acct_mgt import KrakenAPIAcctMgt, load_api_keys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from kraken_decode import concat_ohlc, decode_asset_info, decode_asset_pairs, decode_ohlc
+from kraken_http import get_default_transport
 
 class KrakenAPIMarketData:
-    def __init__(self,since=None):
+    def __init__(self,since=None, transport=None, store=None):
         """
         Initialize the KrakenAPIMarketData object.
 
-        This constructor sets up the KrakenAPIMarketData object with the API key, API secret, and other URL endpoints
-        needed to interact with the Kraken API.
+        This constructor sets up the KrakenAPIMarketData object with the URL endpoints needed to interact with the
+        Kraken API. Only public endpoints are used, so no API key is needed.
 
         Attributes:
-            api_key (str): Kraken API key.
-            api_sec (str): Kraken API secret.
-            url_get_asset_info (str): URL for fetching asset information.
-            url_get_tradable_asset_pairs (str): URL for fetching tradable asset pairs.
-            url_get_OHLC (str): URL for fetching historical OHLC data.
-            uri_get_OHLC_Kraken_signature (str): URI path for generating the API signature for OHLC data.
+            transport (KrakenTransport): The pooled HTTP transport used to send the requests.
+            uri_get_asset_info (str): URI path for fetching asset information.
+            uri_get_tradable_asset_pairs (str): URI path for fetching tradable asset pairs.
+            uri_get_OHLC (str): URI path for fetching historical OHLC data.
             interval (int): Default time interval in minutes for historical data.
+            max_workers (int): Default number of requests sent in parallel by get_historical_data.
+            failed_pairs (dict): The pairs that failed during the last call to get_historical_data, with their error.
+            last_cursors (dict): The 'last' cursor returned by Kraken for each pair downloaded by get_historical_data.
+            store (KrakenStore): The local store get_historical_data reads through, or None to always use the API.
             since (int, optional): Default starting timestamp for historical data. If not provided, the constructor
                                    will use the value corresponding to one week ago from the current time.
+
+        Parameters:
+            since (int, optional): Default starting timestamp for historical data.
+            transport (KrakenTransport, optional): The HTTP transport to use. Default is the transport
+                                                   shared by all the Kraken clients.
+            store (KrakenStore, optional): A local store for the OHLC data. Default is None.
         """
-        self.api_key, self.api_sec = load_api_keys()
-        self.url_get_asset_info = 'https://api.kraken.com/0/public/Assets'
-        self.url_get_tradable_asset_pairs = 'https://api.kraken.com/0/public/AssetPairs'
-        self.url_get_OHLC = "https://api.kraken.com/0/public/OHLC"
+        self.transport = transport if transport is not None else get_default_transport()
+        self.uri_get_asset_info = '/0/public/Assets'
+        self.uri_get_tradable_asset_pairs = '/0/public/AssetPairs'
+        self.uri_get_OHLC = '/0/public/OHLC'
         self.interval = 1440
-        self.kraken_api_acct_mgt = KrakenAPIAcctMgt()
+        self.max_workers = 8
+        self.failed_pairs = {}
+        self.last_cursors = {}
+        self.store = store
 
         if since is None:
             # Calculate one week ago from the current time
@@ -36,22 +48,25 @@ class KrakenAPIMarketData:
         else:
             self.since = since
 
-    def _make_api_call(self, url):
+    def _make_api_call(self, uri_path):
         """
-        Make an API call to the specified URL.
+        Make an API call to the specified URI path.
 
-        This method sends a GET request to the specified URL and returns the JSON response.
+        This method sends a GET request to the specified URI path and returns the JSON response.
 
         Parameters:
-            url (str): The URL for the API call.
+            uri_path (str): The URI path for the API call.
 
         Returns:
             dict: A dictionary containing the JSON response from the API call or None if an error occurred.
         """
         try:
-            resp = requests.get(url)
+            resp = self.transport.get(uri_path)
             resp.raise_for_status()
-            return resp.json()
+            start = time.perf_counter_ns()
+            response = resp.json()
+            self.transport.recorder.record(uri_path, "decode", start)
+            return response
         except requests.exceptions.RequestException as e:
             print(f"An error occurred: {e}")
             return None
@@ -65,12 +80,13 @@ class KrakenAPIMarketData:
         Returns:
             pd.DataFrame: A DataFrame containing information about the available assets.
                           Each row represents an asset, and the columns include details like asset name, symbol, and more.
+                          The numeric fields are typed and the asset classes and statuses are categoricals.
                           Returns None if an error occurred during the API call.
         """
-        resp = self._make_api_call(self.url_get_asset_info)
+        resp = self._make_api_call(self.uri_get_asset_info)
         if resp is not None:
             result_data = resp.get("result", {})
-            df = pd.DataFrame.from_dict(result_data, orient="index")
+            df = decode_asset_info(result_data)
             df["quote"] = df.index
             return df
         return None
@@ -84,82 +100,143 @@ class KrakenAPIMarketData:
         Returns:
             pd.DataFrame: A DataFrame containing tradable asset pairs.
                           Each row represents a trading pair, and the columns include details like base currency, quote currency, and more.
+                          The numeric fields are typed and the assets, classes and statuses are categoricals.
                           Returns None if an error occurred during the API call.
         """
-        resp = self._make_api_call(self.url_get_tradable_asset_pairs)
+        resp = self._make_api_call(self.uri_get_tradable_asset_pairs)
         if resp is not None:
             result_data = resp.get("result", {})
-            df = pd.DataFrame.from_dict(result_data, orient="index")
+            df = decode_asset_pairs(result_data)
             return df
         return None
 
-    def get_historical_data(self, list_pairs, interval=None, since=None):
+    def _get_ohlc_pair(self, pair, interval, since):
+        """
+        Get historical OHLC data for a single asset pair from the Kraken API.
+
+        Parameters:
+            pair (str): The asset pair for which historical data is requested.
+            interval (int): The time interval in minutes for the data.
+            since (int): The starting timestamp for the data.
+
+        Returns:
+            tuple: A DataFrame containing historical OHLC data for the pair, and the 'last' cursor returned
+                   by Kraken, to be used as since to poll for the candles committed after this call.
+
+        Raises:
+            requests.exceptions.RequestException: If the request to the Kraken API failed.
+            ValueError: If the Kraken API answered with an error.
+        """
+        params = {
+            "pair": pair,
+            "interval": interval,
+            "since": since
+        }
+
+        # Send the request to the Kraken API, OHLC is a public endpoint so it is not signed
+        response = self.transport.get(self.uri_get_OHLC, params=params)
+        start = time.perf_counter_ns()
+        response = response.json()
+        self.transport.recorder.record(self.uri_get_OHLC, "decode", start)
+        if response.get('error'):
+            raise ValueError(", ".join(response['error']))
+
+        # Kraken may answer with the canonical pair name (e.g. XXBTZEUR for XBTEUR)
+        result = response['result']
+        if pair in result:
+            rows = result[pair]
+        else:
+            rows = next(value for key, value in result.items() if key != 'last')
+
+        # Decode the arrays into typed columns, the pair is added when the pairs are concatenated
+        df_pair = decode_ohlc(rows)
+        return df_pair, int(result['last'])
+
+    def _sync_ohlc_pair(self, pair, interval, since):
+        """
+        Download the candles of a pair committed since the last sync and merge them into the store.
+
+        Parameters:
+            pair (str): The asset pair to sync.
+            interval (int): The time interval in minutes for the data.
+            since (int): The starting timestamp for the data, used when the pair was never synced.
+
+        Returns:
+            int: The number of candles downloaded.
+        """
+        key = f"ohlc/{pair}/{interval}"
+        df_pair, last = self._get_ohlc_pair(pair, interval, self.store.get_watermark(key, since))
+        # The data is written before the watermark, so an interrupted sync is simply downloaded again
+        self.store.write_ohlc(pair, interval, df_pair)
+        self.store.set_watermark(key, last)
+        return len(df_pair)
+
+    def _read_ohlc_pair(self, pair, interval, since, refresh):
+        """
+        Read the candles of a pair through the store, syncing it first when refresh is True.
+
+        Returns:
+            tuple: A DataFrame containing historical OHLC data for the pair, and its 'last' cursor.
+        """
+        if refresh:
+            self._sync_ohlc_pair(pair, interval, since)
+        df_pair = self.store.read_ohlc(pair, interval, start=since)
+        if df_pair is None:
+            raise KeyError(f"{pair} is not in the store")
+        return df_pair, self.store.get_watermark(f"ohlc/{pair}/{interval}")
+
+    def get_historical_data(self, list_pairs, interval=None, since=None, max_workers=None, refresh=True):
         """
         Get historical OHLC data for a list of asset pairs from the Kraken API.
 
+        The pairs are downloaded concurrently by a pool of threads sharing the pooled transport.
+        A pair that fails is reported and recorded in self.failed_pairs, the other pairs are still returned.
+
+        With a store, only the candles committed since the last call are downloaded, and the data is read
+        back from the store. Pass refresh=False to read the store without calling the API at all.
+
         Parameters:
             list_pairs (list): A list of asset pairs for which historical data is requested.
             interval (int, optional): The time interval in minutes for the data. Default is specified in __init__.
             since (int, optional): The starting timestamp for the data. Default is specified in __init__.
+            max_workers (int, optional): Maximum number of requests sent in parallel. Default is specified in __init__,
+                                         use 1 to download the pairs one at a time.
+            refresh (bool, optional): When a store is set, whether to sync it with the API first. Default is True.
 
         Returns:
             pd.DataFrame: A DataFrame containing historical OHLC data for all asset pairs.
                           The DataFrame has columns like timestamp, open, high, low, close, volume, and more.
-                          The 'pair' column indicates the asset pair associated with each row of data.
-                          Returns None if an error occurred during the API call.
+                          The 'pair' column (categorical) indicates the asset pair associated with each row of data.
+                          The prices and volumes are float64, the timestamps and counts int64, and the index is
+                          the datetime of each candle.
         """
         if interval is None:
             interval = self.interval
         if since is None:
             since = self.since
+        if max_workers is None:
+            max_workers = self.max_workers
 
-        # Set the columns for the DataFrame containing data for all pairs
-        columns_all_pairs = ['pair', 'timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count']
-        
-        # Create an empty DataFrame to contain data for all pairs
-        df_all_pairs = pd.DataFrame(columns=columns_all_pairs)
-
-        # Make a call for each pair in the list
-        for pair in list_pairs:
-            data = {
-                "pair": pair,
-                "interval": interval,
-                "since": since,
-                "nonce": int(1000 * time.time())
-            }
-
-            # Generate the API signature
-            signature = self.kraken_api_acct_mgt.get_kraken_signature(self.url_get_OHLC, data)
-            
-            headers = {
-                "API-Key": self.api_key,
-                "API-Sign": signature
-            }
-
-            try:
-                # Send the request to the Kraken API
-                response = requests.post(self.url_get_OHLC, headers=headers, data=data)
-                # response.raise_for_status()  # Raise an exception if the request was unsuccessful
-                response = response.json()
-                response = response['result'][pair]
-
-                # Define columns for the DataFrame containing data for one pair
-                columns_one_pair = ['timestamp' ,'open', 'high', 'low', 'close', 'vwap', 'volume', 'count']
-                
-                # Create a DataFrame with the response data and the specified columns
-                df_pair = pd.DataFrame(response, columns=columns_one_pair)
-
-                # Add the "pair" column with the current pair name to the DataFrame
-                df_pair["pair"] = pair
-
-                # Concatenate the DataFrame for the current pair with the DataFrame containing data for all pairs
-                df_all_pairs = pd.concat([df_all_pairs, df_pair], axis=0, ignore_index=True)
-        
-            except requests.exceptions.RequestException as e:
-                print(f"An error occurred: {e}")
-    
-        return df_all_pairs
+        # Download every pair, keeping the frames in the order of list_pairs
+        frames = {}
+        self.failed_pairs = {}
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            if self.store is None:
+                futures = {executor.submit(self._get_ohlc_pair, pair, interval, since): pair for pair in list_pairs}
+            else:
+                futures = {executor.submit(self._read_ohlc_pair, pair, interval, since, refresh): pair
+                           for pair in list_pairs}
+            for future in as_completed(futures):
+                pair = futures[future]
+                try:
+                    frames[pair], self.last_cursors[pair] = future.result()
+                except (requests.exceptions.RequestException, ValueError, KeyError, StopIteration) as e:
+                    print(f"An error occurred for {pair}: {e!r}")
+                    self.failed_pairs[pair] = e
 
+        # Concatenate the DataFrames of all the pairs once, at the end
+        pairs = [pair for pair in dict.fromkeys(list_pairs) if pair in frames]
+        return concat_ohlc([frames[pair] for pair in pairs], pairs)
 
 if __name__ == "__main__":
     kraken_api = KrakenAPIMarketData()
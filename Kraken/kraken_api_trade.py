@@ -1,24 +1,63 @@
+import json
 import requests
 import time
-from kraken_api_acct_mgt import KrakenAPIAcctMgt, load_api_keys
+from concurrent.futures import ThreadPoolExecutor
+from kraken_account_cache import ORDER_EVENT_METHODS
+from kraken_http import get_default_transport
+from kraken_signer import get_default_signer, nonce_generator
+
+
+def _order_parameters(order):
+    """
+    The parameters of an order, as sent by AddOrder and AddOrderBatch.
+
+    The pair is left out (AddOrderBatch sends it once for all the orders), and so are the parameters set
+    to None, e.g. the price of a market order, which must not be sent as "None".
+
+    Parameters:
+        order (dict): The order, with the keys ordertype, type, volume, price and pair.
+
+    Returns:
+        dict: The parameters of the order.
+    """
+    return {key: value for key, value in order.items() if key != "pair" and value is not None}
 
 
 class KrakenOrderManager:
-    def __init__(self, validate_value=True):
+    def __init__(self, validate_value=True, transport=None, signer=None, account_cache=None):
         """
         Initialize the KrakenOrderManager.
 
         Parameters:
             validate_value (bool, optional): When set to True, orders won't be placed, only tested.
                                             Default is True.
+            transport (KrakenTransport, optional): The HTTP transport to use. Default is the transport
+                                                   shared by all the Kraken clients.
+            signer (KrakenSigner, optional): The signer to use. Default is the signer shared by all the
+                                             Kraken clients, with the keys from 'keys.txt'.
+            account_cache (KrakenAccountStateCache, optional): An account state cache to invalidate when
+                                                               orders are placed. Default is None.
         """
 
-        self.api_key = load_api_keys()[0]
-        self.api_sec = load_api_keys()[1]
-        self.api_url = "https://api.kraken.com"
+        self.signer = signer if signer is not None else get_default_signer()
+        self.api_key = self.signer.api_key
+        self.api_sec = self.signer.api_sec
+        self.transport = transport if transport is not None else get_default_transport()
+        self.api_url = self.transport.base_url
         self.uri_path_add_order = '/0/private/AddOrder'
+        self.uri_path_add_order_batch = '/0/private/AddOrderBatch'
+        # Kraken accepts between 2 and 15 orders of the same pair in one AddOrderBatch request
+        self.batch_max_size = 15
         self.validate_value = validate_value
-        self.kraken_api_acct_mgt = KrakenAPIAcctMgt()
+        self.account_cache = account_cache
+
+    def _invalidate_account_state(self):
+        """
+        Invalidate the cached balances, open orders and positions once orders were sent to Kraken.
+        """
+        # Validated orders are not placed, they change nothing
+        if self.account_cache is not None and not self.validate_value:
+            self.account_cache.invalidate(ORDER_EVENT_METHODS)
 
     def _create_headers(self):
         """
@@ -45,15 +84,9 @@ class KrakenOrderManager:
         Returns:
             dict: Dictionary containing the data payload for the API request.
         """
-        data = {
-            "nonce": str(int(1000 * time.time())),
-            "ordertype": ordertype,
-            "type": buy_sell_type,
-            "volume": volume,  # Order quantity in terms of the base asset
-            "pair": pair,  # Asset pair id or altname
-            "price": price,  # Limit price for limit orders
-            "validate": self.validate_value  # When set to true, it validates inputs only and doesn't submit orders
-        }
+        data = _order_parameters({"ordertype": ordertype, "type": buy_sell_type, "volume": volume, "price": price})
+        data["pair"] = pair  # Asset pair id or altname
+        data["validate"] = self.validate_value  # When set to true, it validates inputs only and doesn't submit orders
         return data
 
     def _send_kraken_request(self, uri_path, headers, data):
@@ -68,9 +101,13 @@ class KrakenOrderManager:
         Returns:
             dict: JSON response from the Kraken API.
         """
-        headers['API-Sign'] = self.kraken_api_acct_mgt.get_kraken_signature(uri_path, data)
-        response = requests.post((self.api_url + uri_path), headers=headers, data=data)
-        return response.json()
+        # The nonce is taken once the rate limiter lets the request through
+        response = self.transport.post(uri_path, headers=headers,
+                                       sign=lambda: self.signer.sign_request(uri_path, data))
+        start = time.perf_counter_ns()
+        response = response.json()
+        self.transport.recorder.record(uri_path, "decode", start)
+        return response
 
     def place_buy_order(self, ordertype, pair, volume, price):
         """
@@ -86,7 +123,10 @@ class KrakenOrderManager:
         """
         headers = self._create_headers()
         data = self._create_data_payload(ordertype, "buy", pair, volume, price)
-        response = self._send_kraken_request(self.uri_path_add_order, headers, data)
+        try:
+            response = self._send_kraken_request(self.uri_path_add_order, headers, data)
+        finally:
+            self._invalidate_account_state()
         return response
 
     def place_sell_order(self, ordertype, pair, volume, price):
@@ -103,9 +143,120 @@ class KrakenOrderManager:
         """
         headers = self._create_headers()
         data = self._create_data_payload(ordertype, "sell", pair, volume, price)
-        response = self._send_kraken_request(self.uri_path_add_order, headers, data)
+        try:
+            response = self._send_kraken_request(self.uri_path_add_order, headers, data)
+        finally:
+            self._invalidate_account_state()
         return response
 
+    def _send_batch(self, pair, orders):
+        """
+        Send up to 15 orders of the same pair in a single AddOrderBatch request.
+
+        The batch endpoint takes a JSON body, which is signed as is.
+
+        Parameters:
+            pair (str): The asset pair of all the orders.
+            orders (list): The orders, dicts with the keys ordertype, type, volume and price.
+
+        Returns:
+            list: The result of each order, in the format returned by AddOrder.
+        """
+        data = {
+            "orders": [{key: str(value) for key, value in _order_parameters(order).items()} for order in orders],
+            "pair": pair,
+            "validate": self.validate_value
+        }
+        recorder = self.transport.recorder
+
+        def sign():
+            # Called once the rate limiter lets the request through, the nonce is taken then
+            data["nonce"] = str(nonce_generator())
+            start = time.perf_counter_ns()
+            postdata = json.dumps(data)
+            recorder.record(self.uri_path_add_order_batch, "encode", start)
+            headers = self._create_headers()
+            headers['Content-Type'] = 'application/json'
+            start = time.perf_counter_ns()
+            headers['API-Sign'] = self.signer.sign(self.uri_path_add_order_batch, data['nonce'], postdata)
+            recorder.record(self.uri_path_add_order_batch, "sign", start)
+            return headers, postdata
+
+        response = self.transport.post(self.uri_path_add_order_batch, sign=sign)
+        start = time.perf_counter_ns()
+        response = response.json()
+        recorder.record(self.uri_path_add_order_batch, "decode", start)
+
+        # An error of the whole batch applies to each order
+        if response.get('error'):
+            return [{"error": response['error']} for _ in orders]
+        results = []
+        for order_result in response['result']['orders']:
+            if 'error' in order_result:
+                results.append({"error": [order_result['error']]})
+            else:
+                results.append({"error": [], "result": order_result})
+        return results
+
+    def _send_single(self, order):
+        """
+        Send one order with an AddOrder request.
+
+        Returns:
+            list: The result of the order, in a list like _send_batch().
+        """
+        headers = self._create_headers()
+        data = _order_parameters(order)
+        data["pair"] = order["pair"]
+        data["validate"] = self.validate_value
+        return [self._send_kraken_request(self.uri_path_add_order, headers, data)]
+
+    def place_orders(self, orders, max_workers=1):
+        """
+        Place several orders on the Kraken exchange in as few requests as possible.
+
+        The orders are grouped by pair into AddOrderBatch requests of up to 15 orders, a pair with a
+        single order is sent with AddOrder. The requests can be sent concurrently with max_workers.
+
+        Parameters:
+            orders (list): The orders, dicts with the keys ordertype, type ('buy' or 'sell'), pair, volume
+                           and price (omitted or None for market orders). The other keys are sent as
+                           parameters of the order, except those set to None.
+            max_workers (int, optional): Maximum number of requests sent in parallel. Default is 1: concurrent
+                                         requests may reach Kraken out of the order of their nonces, so only
+                                         raise it when a nonce window is set on the API key.
+
+        Returns:
+            list: The result of each order, in the same order as orders. Each result is a dict in the format
+                  returned by AddOrder: {"error": [...], "result": {"txid": ..., "descr": ...}}.
+        """
+        # Group the orders by pair, keeping their position in the list
+        indices_by_pair = {}
+        for index, order in enumerate(orders):
+            indices_by_pair.setdefault(order["pair"], []).append(index)
+
+        tasks = []
+        for pair, indices in indices_by_pair.items():
+            for start in range(0, len(indices), self.batch_max_size):
+                chunk = indices[start:start + self.batch_max_size]
+                if len(chunk) == 1:
+                    tasks.append((chunk, self._send_single, (orders[chunk[0]],)))
+                else:
+                    tasks.append((chunk, self._send_batch, (pair, [orders[index] for index in chunk])))
+
+        results = [None] * len(orders)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [(chunk, executor.submit(function, *args)) for chunk, function, args in tasks]
+            for chunk, future in futures:
+                try:
+                    chunk_results = future.result()
+                except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                    chunk_results = [{"error": [repr(e)]} for _ in chunk]
+                for index, result in zip(chunk, chunk_results):
+                    results[index] = result
+        self._invalidate_account_state()
+        return results
+
 
 if __name__ == "__main__":
     # Create an instance of KrakenOrderManager
@@ -126,3 +277,14 @@ if __name__ == "__main__":
     print("\n")
     print("Sell order:")
     print(resp)
+
+    # Place several orders in a single call and print the results
+    orders = [
+        {"ordertype": ordertype, "type": "buy", "pair": pair, "volume": volume_pair, "price": price_pair},
+        {"ordertype": ordertype, "type": "sell", "pair": pair, "volume": volume_pair, "price": price_pair + 1000},
+        {"ordertype": ordertype, "type": "buy", "pair": "ETHUSD", "volume": 1, "price": 1500},
+    ]
+    resp = order_manager.place_orders(orders)
+    print("\n")
+    print("Bulk orders:")
+    print(resp)
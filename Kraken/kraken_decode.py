@@ -0,0 +1,168 @@
+import numpy as np
+import pandas as pd
+
+# Columns of the OHLC arrays returned by Kraken, and their types once decoded
+OHLC_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count']
+OHLC_DTYPES = {
+    "timestamp": "int64",
+    "open": "float64",
+    "high": "float64",
+    "low": "float64",
+    "close": "float64",
+    "vwap": "float64",
+    "volume": "float64",
+    "count": "int64",
+}
+
+# Types of the fields of the Assets and AssetPairs results, the other fields are left as returned
+ASSET_DTYPES = {
+    "aclass": "category",
+    "altname": "string",
+    "decimals": "int64",
+    "display_decimals": "int64",
+    "collateral_value": "float64",
+    "status": "category",
+}
+ASSET_PAIR_DTYPES = {
+    "altname": "string",
+    "wsname": "string",
+    "aclass_base": "category",
+    "base": "category",
+    "aclass_quote": "category",
+    "quote": "category",
+    "lot": "category",
+    "cost_decimals": "int64",
+    "pair_decimals": "int64",
+    "lot_decimals": "int64",
+    "lot_multiplier": "int64",
+    "fee_volume_currency": "category",
+    "margin_call": "int64",
+    "margin_stop": "int64",
+    "ordermin": "float64",
+    "costmin": "float64",
+    "tick_size": "float64",
+    "status": "category",
+    "long_position_limit": "float64",
+    "short_position_limit": "float64",
+}
+
+
+def decode_ohlc(rows):
+    """
+    Decodes the OHLC arrays of a Kraken response into typed columns.
+
+    The rows are converted in one pass into a 2D array, then each block of columns is cast at once:
+    the prices and volumes, sent as strings, become float64 and the timestamps and counts int64.
+
+    Parameters:
+        rows (list): The OHLC arrays, [time, open, high, low, close, vwap, volume, count].
+
+    Returns:
+        pd.DataFrame: The candles, with the OHLC_COLUMNS and a datetime index named 'time'.
+    """
+    if len(rows) == 0:
+        df = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in OHLC_DTYPES.items()})
+        df.index = pd.DatetimeIndex([], name="time")
+        return df
+
+    array = np.array(rows, dtype=object)
+    timestamps = array[:, 0].astype('int64')
+    df = pd.DataFrame(array[:, 1:7].astype('float64'), columns=OHLC_COLUMNS[1:7],
+                      index=pd.DatetimeIndex(timestamps.astype('datetime64[s]'), name="time"))
+    df.insert(0, "timestamp", timestamps)
+    df["count"] = array[:, 7].astype('int64')
+    return df
+
+
+def concat_ohlc(frames, pairs):
+    """
+    Concatenates the candles of several pairs, with a categorical 'pair' column in first position.
+
+    Parameters:
+        frames (list): The candles of each pair, as returned by decode_ohlc or KrakenStore.read_ohlc.
+        pairs (list): The pair of each frame.
+
+    Returns:
+        pd.DataFrame: The candles of all the pairs, with a datetime index named 'time'.
+    """
+    frames = [df.drop(columns="pair", errors="ignore") for df in frames]
+    if frames:
+        df = pd.concat(frames, axis=0)
+    else:
+        df = decode_ohlc([])
+    df = df[OHLC_COLUMNS].astype(OHLC_DTYPES)
+    df.index = pd.DatetimeIndex(df["timestamp"].to_numpy().astype('datetime64[s]'), name="time")
+
+    # The pair of each row is a code into the list of pairs, the names are not repeated
+    codes = np.repeat(np.arange(len(frames), dtype='int32'), [len(frame) for frame in frames])
+    df.insert(0, "pair", pd.Categorical.from_codes(codes, categories=pd.Index(pairs, dtype=object)))
+    return df
+
+
+def _decode_results(result, dtypes, index_name):
+    """
+    Builds a typed DataFrame from a result keyed by name, such as the results of Assets and AssetPairs.
+    """
+    df = pd.DataFrame.from_dict(result, orient="index")
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        if dtype in ("int64", "float64"):
+            values = pd.to_numeric(df[column], errors="coerce")
+            # A missing integer cannot be stored in an int64 column
+            df[column] = values.astype("float64" if values.isna().any() else dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+    df.index.name = index_name
+    return df
+
+
+def decode_asset_info(result):
+    """
+    Decodes the result of the Assets endpoint into a DataFrame with one row per asset.
+    """
+    return _decode_results(result, ASSET_DTYPES, "asset")
+
+
+def decode_asset_pairs(result):
+    """
+    Decodes the result of the AssetPairs endpoint into a DataFrame with one row per pair.
+    """
+    return _decode_results(result, ASSET_PAIR_DTYPES, "pair")
+
+
+def _synthetic_ohlc(n, seed=0):
+    rng = np.random.default_rng(seed)
+    prices = 30000 + np.cumsum(rng.normal(0, 10, n))
+    volumes = rng.random(n) * 10
+    counts = rng.integers(1, 500, n)
+    return [[1600000000 + 60 * i, f"{p:.1f}", f"{p + 5:.1f}", f"{p - 5:.1f}", f"{p + 1:.1f}", f"{p:.2f}",
+             f"{v:.8f}", int(c)] for i, (p, v, c) in enumerate(zip(prices, volumes, counts))]
+
+
+if __name__ == "__main__":
+    import time
+
+    # Compare the time and memory per million rows of the previous construction and of decode_ohlc
+    n = 1000000
+    rows = _synthetic_ohlc(n)
+
+    def legacy(rows):
+        df = pd.DataFrame(rows, columns=OHLC_COLUMNS)
+        df["pair"] = "XXBTZEUR"
+        return df
+
+    def typed(rows):
+        return concat_ohlc([decode_ohlc(rows)], ["XXBTZEUR"])
+
+    for name, function in (("before (object columns)", legacy), ("after (typed columns)", typed)):
+        start = time.perf_counter()
+        df = function(rows)
+        elapsed = time.perf_counter() - start
+        memory = df.memory_usage(deep=True).sum()
+        print(f"{name}: {elapsed * 1e6 / n:.2f} s and {memory * 1e6 / n / 2 ** 20:.1f} MiB per million rows")
+
+    # The legacy frame must still be cast before any computation
+    start = time.perf_counter()
+    legacy(rows).astype(OHLC_DTYPES)
+    print(f"before, cast to the same types: {(time.perf_counter() - start) * 1e6 / n:.2f} s per million rows")
@@ -0,0 +1,527 @@
+import bisect
+import io
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import requests
+from requests.adapters import BaseAdapter
+from kraken_http import KrakenTransport
+
+# Number of results per page of ClosedOrders, like Kraken
+CLOSED_ORDERS_PAGE_SIZE = 50
+
+
+def _split_pair(pair):
+    """
+    Returns the base and quote assets of a Kraken pair name, e.g. ('XXBT', 'ZEUR') for 'XXBTZEUR'
+    and ('XBT', 'USD') for 'XBTUSD'.
+    """
+    if len(pair) == 8 and pair[0] in "XZ" and pair[4] in "XZ":
+        return pair[:4], pair[4:]
+    return pair[:-3], pair[-3:]
+
+
+def _format(value):
+    return f"{value:.10f}".rstrip("0").rstrip(".") if value else "0"
+
+
+class KrakenExchangeSim:
+    """
+    A local simulated Kraken exchange, for paper trading and tests without the network.
+
+    The private trading endpoints (AddOrder, AddOrderBatch, CancelOrder, OpenOrders, ClosedOrders, QueryOrders
+    and Balance) are answered from an in-process matching engine in Kraken's response format. The market is
+    replayed from stored OHLC candles or trades: the simulation clock only moves when advance() is called, so
+    a strategy runs as fast as it can place orders instead of waiting for the market.
+
+    Matching rules:
+        - A market order, or a limit order at or through the last price, fills at the last price (the close of
+          the last replayed candle).
+        - A resting limit buy fills during a candle whose low reaches its price, at its price or at the open if
+          the candle opens below it (and symmetrically for the sells).
+        - Orders fill completely, the volume of the candles is not taken into account.
+        - The fee is charged in the quote asset. The funds of the open orders are held, and an order that
+          exceeds the available balance is rejected like on Kraken.
+
+    Attributes:
+        balances (dict): The balance of each asset.
+        fee (float): The fee rate charged on the cost of each fill.
+        time (int): The simulation clock, the timestamp of the last replayed candle.
+        orders (dict): The information of every order, keyed by txid, in Kraken's format.
+
+    Methods:
+        load_ohlc(pair, df) / load_trades(pair, df):
+            Loads the market data of a pair.
+
+        advance(bars, until):
+            Replays candles and fills the resting orders they reach.
+
+        dispatch(uri_path, data):
+            Answers a request to a private endpoint.
+
+        attach(transport):
+            Routes the requests of a KrakenTransport to the simulator, in process.
+    """
+    def __init__(self, balances=None, fee=0.0026, store=None, pairs=(), interval=1440, pair_assets=None):
+        """
+        Initializes the KrakenExchangeSim class.
+
+        Parameters:
+            balances (dict, optional): The initial balance of each asset, e.g. {"ZEUR": 10000}. Default is empty.
+            fee (float, optional): The fee rate charged on the cost of each fill. Default is 0.0026 (0.26%).
+            store (KrakenStore, optional): A store to load the candles of pairs from. Default is None.
+            pairs (list, optional): The pairs to load from the store. Default is none.
+            interval (int, optional): The interval of the candles loaded from the store. Default is 1440.
+            pair_assets (dict, optional): The (base, quote) assets of the pairs whose names cannot be split
+                                          like Kraken's, e.g. {"XBTUSDT": ("XBT", "USDT")}.
+        """
+        self.balances = {asset: float(amount) for asset, amount in (balances or {}).items()}
+        self.fee = fee
+        self.time = None
+        self.orders = {}
+        self.pair_assets = dict(pair_assets or {})
+        self._holds = {}
+        self._markets = {}
+        self._open = {}
+        self._closed = []
+        self._sequence = 0
+        self._lock = threading.RLock()
+        for pair in pairs:
+            df = store.read_ohlc(pair, interval)
+            if df is None:
+                raise KeyError(f"{pair} is not in the store")
+            self.load_ohlc(pair, df)
+
+    # ---------------------------------------------------------------------------------------------
+    # Market data
+
+    def load_ohlc(self, pair, df):
+        """
+        Loads the candles of a pair, e.g. from KrakenStore.read_ohlc or KrakenAPIMarketData.get_historical_data.
+
+        Parameters:
+            pair (str): The pair name used in the orders.
+            df (pd.DataFrame): The candles, with the columns timestamp, open, high, low and close.
+        """
+        df = df.sort_values("timestamp")
+        with self._lock:
+            self._markets[pair] = {
+                "timestamp": df["timestamp"].to_numpy(dtype='int64'),
+                "open": df["open"].to_numpy(dtype='float64'),
+                "high": df["high"].to_numpy(dtype='float64'),
+                "low": df["low"].to_numpy(dtype='float64'),
+                "close": df["close"].to_numpy(dtype='float64'),
+                "next": 0,
+            }
+            # Resting buys are sorted by decreasing price and sells by increasing price: (key, sequence, txid)
+            self._open.setdefault(pair, {"buy": [], "sell": []})
+            first = int(self._markets[pair]["timestamp"][0]) if len(df) else None
+            if first is not None and (self.time is None or first - 1 < self.time):
+                self.time = first - 1
+
+    def load_trades(self, pair, df, time_col="timestamp"):
+        """
+        Loads the trades of a pair, each trade being replayed as a candle at its price.
+
+        Parameters:
+            pair (str): The pair name used in the orders.
+            df (pd.DataFrame): The trades, with a timestamp column in seconds and a price column.
+            time_col (str, optional): The name of the timestamp column. Default is 'timestamp'.
+        """
+        prices = df["price"].to_numpy(dtype='float64')
+        candles = df[[time_col]].rename(columns={time_col: "timestamp"}).astype({"timestamp": "int64"})
+        for column in ("open", "high", "low", "close"):
+            candles[column] = prices
+        self.load_ohlc(pair, candles)
+
+    def last_price(self, pair):
+        """
+        Returns the last price of a pair: the close of the last replayed candle, or the open of the first one.
+        """
+        market = self._markets[pair]
+        if market["next"] == 0:
+            return float(market["open"][0])
+        return float(market["close"][market["next"] - 1])
+
+    def advance(self, bars=1, until=None):
+        """
+        Moves the simulation clock and fills the resting orders reached by the replayed candles.
+
+        Parameters:
+            bars (int, optional): Number of timestamps to replay, across all the pairs. Default is 1.
+            until (int, optional): Replay all the candles up to this timestamp instead.
+
+        Returns:
+            bool: False once all the candles were replayed.
+        """
+        with self._lock:
+            if until is None:
+                pending = [market["timestamp"][market["next"]:market["next"] + bars]
+                           for market in self._markets.values() if market["next"] < len(market["timestamp"])]
+                if not pending:
+                    return False
+                until = int(np.unique(np.concatenate(pending))[:bars][-1])
+
+            for pair, market in self._markets.items():
+                timestamps = market["timestamp"]
+                end = int(np.searchsorted(timestamps, until, side='right'))
+                for i in range(market["next"], end):
+                    book = self._open[pair]
+                    if not book["buy"] and not book["sell"]:
+                        break
+                    self._match_candle(pair, market, i)
+                market["next"] = max(market["next"], end)
+            self.time = until
+            return any(market["next"] < len(market["timestamp"]) for market in self._markets.values())
+
+    def _match_candle(self, pair, market, i):
+        open_, low, high = market["open"][i], market["low"][i], market["high"][i]
+        book = self._open[pair]
+        timestamp = int(market["timestamp"][i])
+
+        # The buys with a price at or above the low are all at the start of the list
+        buys = book["buy"]
+        filled = bisect.bisect_right(buys, (-low, float("inf")))
+        for key, _, txid in buys[:filled]:
+            self._fill(txid, min(-key, open_), timestamp)
+        del buys[:filled]
+
+        sells = book["sell"]
+        filled = bisect.bisect_right(sells, (high, float("inf")))
+        for key, _, txid in sells[:filled]:
+            self._fill(txid, max(key, open_), timestamp)
+        del sells[:filled]
+
+    # ---------------------------------------------------------------------------------------------
+    # Orders and balances
+
+    def _assets(self, pair):
+        return self.pair_assets.get(pair) or _split_pair(pair)
+
+    def _available(self, asset):
+        return self.balances.get(asset, 0.0) - self._holds.get(asset, 0.0)
+
+    def _hold(self, order):
+        base, quote = self._assets(order["descr"]["pair"])
+        if order["descr"]["type"] == "buy":
+            return quote, float(order["vol"]) * float(order["descr"]["price"]) * (1 + self.fee)
+        return base, float(order["vol"])
+
+    def _fill(self, txid, price, timestamp):
+        order = self.orders[txid]
+        base, quote = self._assets(order["descr"]["pair"])
+        volume = float(order["vol"])
+        if order["descr"]["ordertype"] == "limit":
+            asset, amount = self._hold(order)
+            self._holds[asset] -= amount
+        cost = volume * price
+        fee = cost * self.fee
+        if order["descr"]["type"] == "buy":
+            self.balances[base] = self.balances.get(base, 0.0) + volume
+            self.balances[quote] = self.balances.get(quote, 0.0) - cost - fee
+        else:
+            self.balances[base] = self.balances.get(base, 0.0) - volume
+            self.balances[quote] = self.balances.get(quote, 0.0) + cost - fee
+        order.update(status="closed", closetm=timestamp, vol_exec=order["vol"], cost=_format(cost), fee=_format(fee),
+                     price=_format(price), reason=None)
+        self._closed.append(txid)
+
+    def _add_order(self, data):
+        """
+        Validates an order and places it unless validate is set.
+
+        Returns:
+            dict: The result of the order, in the format of AddOrder, or an 'error' key.
+        """
+        pair = data.get("pair")
+        if pair not in self._markets:
+            return {"error": "EQuery:Unknown asset pair"}
+        ordertype, side = data.get("ordertype"), data.get("type")
+        if ordertype not in ("market", "limit"):
+            return {"error": "EGeneral:Invalid arguments:ordertype"}
+        if side not in ("buy", "sell"):
+            return {"error": "EGeneral:Invalid arguments:type"}
+        try:
+            volume = float(data.get("volume"))
+            price = float(data["price"]) if ordertype == "limit" else self.last_price(pair)
+        except (KeyError, TypeError, ValueError):
+            return {"error": "EGeneral:Invalid arguments"}
+        if volume <= 0 or price <= 0:
+            return {"error": "EGeneral:Invalid arguments:volume"}
+
+        description = f"{side} {_format(volume)} {pair} @ " + (f"limit {_format(price)}" if ordertype == "limit"
+                                                                 else "market")
+        if str(data.get("validate", "false")).lower() == "true":
+            return {"descr": {"order": description}}
+
+        self._sequence += 1
+        txid = f"O{self._sequence:05d}-SIMUL-{self._sequence % 1000000:06d}"
+        order = {
+            "refid": None, "userref": 0, "status": "open", "opentm": self.time, "starttm": 0, "expiretm": 0,
+            "descr": {"pair": pair, "type": side, "ordertype": ordertype, "price": _format(price), "price2": "0",
+                      "leverage": "none", "order": description, "close": ""},
+            "vol": _format(volume), "vol_exec": "0", "cost": "0", "fee": "0", "price": "0", "stopprice": "0",
+            "limitprice": "0", "misc": "", "oflags": "fciq",
+        }
+        asset, amount = self._hold(order)
+        if amount > self._available(asset) + 1e-12:
+            return {"error": "EOrder:Insufficient funds"}
+        self.orders[txid] = order
+
+        last_price = self.last_price(pair)
+        marketable = side == "buy" and price >= last_price or side == "sell" and price <= last_price
+        if ordertype == "market" or marketable:
+            if ordertype == "limit":
+                self._holds[asset] = self._holds.get(asset, 0.0) + amount
+            self._fill(txid, last_price, self.time)
+        else:
+            self._holds[asset] = self._holds.get(asset, 0.0) + amount
+            key = -price if side == "buy" else price
+            bisect.insort(self._open[pair][side], (key, self._sequence, txid))
+        return {"descr": {"order": description}, "txid": txid}
+
+    def _cancel_order(self, txid):
+        order = self.orders.get(txid)
+        if order is None or order["status"] != "open":
+            return 0
+        pair, side = order["descr"]["pair"], order["descr"]["type"]
+        self._open[pair][side] = [entry for entry in self._open[pair][side] if entry[2] != txid]
+        asset, amount = self._hold(order)
+        self._holds[asset] -= amount
+        order.update(status="canceled", closetm=self.time, reason="User requested")
+        self._closed.append(txid)
+        return 1
+
+    # ---------------------------------------------------------------------------------------------
+    # Endpoints
+
+    def dispatch(self, uri_path, data):
+        """
+        Answers a request to a private endpoint.
+
+        Parameters:
+            uri_path (str): The API endpoint URI path, e.g. '/0/private/AddOrder'.
+            data (dict): The request data parameters (strings, like the form-encoded body).
+
+        Returns:
+            dict: The response in Kraken's format, {"error": [...], "result": ...}.
+        """
+        method = uri_path.rsplit("/", 1)[-1]
+        with self._lock:
+            if method == "AddOrder":
+                result = self._add_order(data)
+                if "error" in result:
+                    return {"error": [result["error"]]}
+                return {"error": [], "result": {"descr": result["descr"], "txid": [result["txid"]]}
+                        if "txid" in result else {"descr": result["descr"]}}
+
+            if method == "AddOrderBatch":
+                results = []
+                for order in data.get("orders", []):
+                    result = self._add_order(dict(order, pair=data.get("pair"), validate=data.get("validate")))
+                    if "txid" in result:
+                        result = {"descr": result["descr"], "txid": result["txid"]}
+                    results.append(result)
+                return {"error": [], "result": {"orders": results}}
+
+            if method == "CancelOrder":
+                count = sum(self._cancel_order(txid) for txid in str(data.get("txid", "")).split(","))
+                return {"error": [], "result": {"count": count}}
+
+            if method == "OpenOrders":
+                orders = {txid: self.orders[txid] for book in self._open.values()
+                          for side in ("buy", "sell") for _, _, txid in book[side]}
+                return {"error": [], "result": {"open": orders}}
+
+            if method == "ClosedOrders":
+                start, end = data.get("start"), data.get("end")
+                txids = [txid for txid in reversed(self._closed)
+                         if (start is None or self.orders[txid]["closetm"] > float(start))
+                         and (end is None or self.orders[txid]["closetm"] <= float(end))]
+                ofs = int(data.get("ofs", 0))
+                page = txids[ofs:ofs + CLOSED_ORDERS_PAGE_SIZE]
+                return {"error": [], "result": {"closed": {txid: self.orders[txid] for txid in page},
+                                                "count": len(txids)}}
+
+            if method == "QueryOrders":
+                txids = str(data.get("txid", "")).split(",")
+                return {"error": [], "result": {txid: self.orders[txid] for txid in txids if txid in self.orders}}
+
+            if method == "Balance":
+                return {"error": [], "result": {asset: _format(amount) for asset, amount in self.balances.items()}}
+
+        return {"error": ["EGeneral:Unknown method"]}
+
+    def handle(self, uri_path, body, content_type=None):
+        """
+        Answers a request with an encoded body (form-encoded, or JSON for AddOrderBatch).
+
+        Returns:
+            dict: The response in Kraken's format.
+        """
+        if isinstance(body, bytes):
+            body = body.decode()
+        body = body or ""
+        if (content_type or "").startswith("application/json") or body.startswith("{"):
+            data = json.loads(body)
+        else:
+            data = dict(urllib.parse.parse_qsl(body))
+        return self.dispatch(urllib.parse.urlsplit(uri_path).path, data)
+
+    def attach(self, transport, rate_limit=False):
+        """
+        Routes all the requests of a KrakenTransport to the simulator, without the network.
+
+        Parameters:
+            transport (KrakenTransport): The transport of the clients, e.g. KrakenTransport(base_url="http://sim").
+            rate_limit (bool, optional): Whether to keep Kraken's rate limits. Default is False, to run as fast
+                                         as possible.
+        """
+        transport.session.mount(transport.base_url, KrakenSimAdapter(self))
+        # Nothing goes through a proxy: skip the scan of the environment requests makes on each request
+        transport.session.trust_env = False
+        if not rate_limit:
+            transport.rate_limiter = None
+
+
+class KrakenSimAdapter(BaseAdapter):
+    """
+    A requests adapter answering the requests from a KrakenExchangeSim, in process.
+    """
+    def __init__(self, sim):
+        super().__init__()
+        self.sim = sim
+
+    def send(self, request, **kwargs):
+        content = json.dumps(self.sim.handle(request.path_url, request.body,
+                                             request.headers.get("Content-Type"))).encode()
+        response = requests.Response()
+        response.status_code = 200
+        response.headers["Content-Type"] = "application/json"
+        response._content = content
+        response.raw = io.BytesIO(content)
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class KrakenExchangeSimServer:
+    """
+    Serves a KrakenExchangeSim over HTTP, for clients in other processes.
+
+    Point the clients at it with the KRAKEN_API_URL environment variable, set to the url returned by start().
+    Their default transport keeps Kraken's rate limits, so the requests are throttled as on the exchange;
+    give them the transport returned by transport() (or KrakenTransport(rate_limiter=False)) to run at full
+    speed.
+
+    Attributes:
+        sim (KrakenExchangeSim): The simulated exchange.
+        url (str): The base URL of the server, once started.
+    """
+    def __init__(self, sim, host="127.0.0.1", port=0):
+        self.sim = sim
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _answer(self, response):
+                content = json.dumps(response).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self._answer(self.server.sim.handle(self.path, body, self.headers.get("Content-Type")))
+
+            def do_GET(self):
+                self._answer({"error": ["EGeneral:Unknown method"]})
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._server.sim = sim
+        self._thread = None
+        self.url = None
+
+    def start(self):
+        """
+        Starts the server in a background thread.
+
+        Returns:
+            str: The base URL of the server.
+        """
+        host, port = self._server.server_address[:2]
+        self.url = f"http://{host}:{port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def transport(self, **kwargs):
+        """
+        Returns a KrakenTransport sending its requests to the server, without Kraken's rate limits.
+
+        Parameters:
+            **kwargs: The other arguments of KrakenTransport, e.g. rate_limiter to keep the rate limits.
+
+        Returns:
+            KrakenTransport: The transport, to pass to the clients or to set_default_transport().
+        """
+        kwargs.setdefault("rate_limiter", False)
+        return KrakenTransport(base_url=self.url, **kwargs)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    import base64
+    import os
+    import time
+    import pandas as pd
+    from kraken_api_acct_mgt import KrakenAPIAcctMgt
+    from kraken_api_trade import KrakenOrderManager
+    from kraken_signer import KrakenSigner
+
+    # Replay a random walk of daily candles and trade around the price with the unmodified clients
+    rng = np.random.default_rng(0)
+    n_bars = 10000
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.02, n_bars)))
+    df = pd.DataFrame({"timestamp": 1500000000 + 86400 * np.arange(n_bars), "open": np.roll(close, 1),
+                       "high": close * 1.01, "low": close * 0.99, "close": close})
+    df.loc[0, "open"] = close[0]
+
+    sim = KrakenExchangeSim(balances={"ZEUR": 1e9, "XXBT": 1e4})
+    sim.load_ohlc("XXBTZEUR", df)
+    transport = KrakenTransport(base_url="http://kraken-sim")
+    sim.attach(transport)
+    signer = KrakenSigner("sim", base64.b64encode(os.urandom(64)).decode())
+    order_manager = KrakenOrderManager(validate_value=False, transport=transport, signer=signer)
+    acct_mgt = KrakenAPIAcctMgt(transport=transport, signer=signer)
+
+    n_orders = 0
+    start = time.perf_counter()
+    while True:
+        price = sim.last_price("XXBTZEUR")
+        order_manager.place_buy_order("limit", "XXBTZEUR", 0.01, round(price * 0.995, 1))
+        order_manager.place_sell_order("limit", "XXBTZEUR", 0.01, round(price * 1.005, 1))
+        n_orders += 2
+        if not sim.advance():
+            break
+    elapsed = time.perf_counter() - start
+
+    print(f"{n_orders} orders and {n_bars} candles in {elapsed:.2f}s: {n_orders / elapsed:,.0f} orders/s")
+    print(f"Open orders: {len(acct_mgt.get_open_orders(True)['result']['open'])}")
+    print(f"Closed orders: {acct_mgt.get_closed_orders()['result']['count']}")
+    print(f"Balance: {acct_mgt.get_balance()['result']}")
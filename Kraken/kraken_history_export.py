@@ -0,0 +1,147 @@
+import time
+import requests
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from kraken_api_acct_mgt import KrakenAPIAcctMgt
+from kraken_store import KrakenStore
+
+# Kraken returns the history 50 results at a time
+PAGE_SIZE = 50
+
+# Kraken sends the amounts as strings
+NUMERIC_COLUMNS = {"time", "price", "cost", "fee", "vol", "margin", "vol_exec", "stopprice", "limitprice",
+                   "opentm", "closetm", "starttm", "expiretm"}
+
+
+class KrakenHistoryExporter:
+    """
+    Exports the full trades history and closed orders of the account to the KrakenStore.
+
+    TradesHistory and ClosedOrders only return 50 results per call: the exporter pages through the
+    whole history, optionally running several pages in parallel (the shared rate limiter spaces them out), and
+    writes each page to the store as soon as it arrives. The timestamp of the last exported result is kept as a
+    watermark, so the next export only requests the newer results.
+
+    Attributes:
+        acct_mgt (KrakenAPIAcctMgt): The client used to request the history.
+        store (KrakenStore): The store the history is written to.
+        max_workers (int): Maximum number of pages requested in parallel.
+
+    Methods:
+        export_trades_history():
+            Exports the trades executed since the last export.
+
+        export_closed_orders():
+            Exports the orders closed since the last export.
+    """
+    def __init__(self, acct_mgt=None, store=None, max_workers=1):
+        """
+        Initializes the KrakenHistoryExporter class.
+
+        Parameters:
+            acct_mgt (KrakenAPIAcctMgt, optional): The client used to request the history. Default is a new one.
+            store (KrakenStore, optional): The store the history is written to. Default is a new KrakenStore.
+            max_workers (int, optional): Maximum number of pages requested in parallel. Default is 1: concurrent
+                                         requests may reach Kraken out of the order of their nonces, so only
+                                         raise it when a nonce window is set on the API key.
+        """
+        self.acct_mgt = acct_mgt if acct_mgt is not None else KrakenAPIAcctMgt()
+        self.store = store if store is not None else KrakenStore()
+        self.max_workers = max_workers
+
+    @staticmethod
+    def _page_to_frame(page):
+        """
+        Flattens a page of results ({txid: {...}}) into a DataFrame with a 'txid' column.
+        """
+        df = pd.json_normalize(list(page.values()), sep="_")
+        df.insert(0, "txid", list(page.keys()))
+        for column in df.columns:
+            if column in NUMERIC_COLUMNS or column.rsplit("_", 1)[-1] == "price":
+                df[column] = pd.to_numeric(df[column], errors="coerce").astype("float64")
+        return df
+
+    def _export(self, dataset, fetch, result_key, time_col):
+        """
+        Pages through one history endpoint and writes the results to the store.
+
+        Parameters:
+            dataset (str): The name of the dataset in the store.
+            fetch (function): The KrakenAPIAcctMgt method returning a page, called with ofs, start and end.
+            result_key (str): The key of the results in the response ('trades' or 'closed').
+            time_col (str): The name of the timestamp column of the results.
+
+        Returns:
+            int: The number of results exported.
+        """
+        watermark_key = f"history/{dataset}"
+        start = self.store.get_watermark(watermark_key)
+        # The end is fixed for the whole export, so that new results do not shift the pages while they are read
+        end = time.time()
+
+        def fetch_page(ofs):
+            response = fetch(ofs=ofs, start=start, end=end)
+            if response.get("error"):
+                raise ValueError(", ".join(response["error"]))
+            return response["result"]
+
+        def write_page(result):
+            page = result[result_key]
+            if not page:
+                return 0, None
+            df = self._page_to_frame(page)
+            self.store.write_history(dataset, df, time_col, unique_key="txid")
+            return len(df), df[time_col].max()
+
+        # The first page gives the number of results
+        first = fetch_page(0)
+        exported, last_time = write_page(first)
+        failed_pages = []
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            futures = {executor.submit(fetch_page, ofs): ofs for ofs in range(PAGE_SIZE, first["count"], PAGE_SIZE)}
+            for future in as_completed(futures):
+                try:
+                    n_rows, page_last_time = write_page(future.result())
+                except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                    print(f"An error occurred for the page at offset {futures[future]}: {e!r}")
+                    failed_pages.append(futures[future])
+                    continue
+                exported += n_rows
+                if page_last_time is not None and (last_time is None or page_last_time > last_time):
+                    last_time = page_last_time
+
+        # The watermark only moves once every page is written: after a failure, the next export requests
+        # the same range again and the rows already written are replaced, not duplicated
+        if not failed_pages and last_time is not None:
+            self.store.set_watermark(watermark_key, float(last_time))
+        return exported
+
+    def export_trades_history(self):
+        """
+        Exports the trades executed since the last export to the 'trades_history' dataset of the store.
+
+        Returns:
+            int: The number of trades exported.
+        """
+        return self._export("trades_history", self.acct_mgt.get_trades_history, "trades", "time")
+
+    def export_closed_orders(self):
+        """
+        Exports the orders closed since the last export to the 'closed_orders' dataset of the store.
+
+        Returns:
+            int: The number of orders exported.
+        """
+        return self._export("closed_orders", self.acct_mgt.get_closed_orders, "closed", "closetm")
+
+
+if __name__ == "__main__":
+    exporter = KrakenHistoryExporter()
+
+    print("\nExport Trades History:")
+    print(exporter.export_trades_history())
+    print(exporter.store.read_history("trades_history"))
+
+    print("\nExport Closed Orders:")
+    print(exporter.export_closed_orders())
+    print(exporter.store.read_history("closed_orders", time_col="closetm"))
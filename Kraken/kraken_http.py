@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from kraken_metrics import get_default_recorder
+from kraken_rate_limit import get_default_rate_limiter
+
+# Base URL of the Kraken REST API. It can be overridden with the KRAKEN_API_URL environment
+# variable so that a local stub server can stand in for api.kraken.com in tests and benchmarks.
+DEFAULT_API_URL = "https://api.kraken.com"
+
+
+class KrakenTransport:
+    """
+    A shared HTTP transport for all the Kraken clients.
+
+    It wraps a single requests.Session so that TCP+TLS connections to the API are kept alive and
+    pooled between calls, instead of being opened again on every request.
+
+    Attributes:
+        base_url (str): The base URL for the Kraken API (no trailing slash).
+        timeout (float or tuple): Timeout in seconds (connect, read) applied to every request.
+        session (requests.Session): The pooled session used to send the requests.
+        rate_limiter (KrakenRateLimiter): The scheduler keeping the requests within Kraken's rate limits,
+                                          or None to send them right away.
+        recorder (LatencyRecorder): Records the wait for the rate limiter and the network time of each request.
+
+    Methods:
+        get(uri_path, params):
+            Sends a GET request to the Kraken API and returns the response.
+
+        post(uri_path, headers, data, sign):
+            Sends a POST request to the Kraken API and returns the response.
+
+        close():
+            Closes all the pooled connections.
+    """
+    def __init__(self, base_url=None, timeout=(3.05, 10), pool_maxsize=32, max_retries=3, backoff_factor=0.3,
+                 rate_limiter=None, recorder=None):
+        """
+        Initializes the KrakenTransport class.
+
+        Parameters:
+            base_url (str, optional): The base URL for the Kraken API. Default is the KRAKEN_API_URL
+                                      environment variable, or https://api.kraken.com.
+            timeout (float or tuple, optional): Timeout in seconds (connect, read). Default is (3.05, 10).
+            pool_maxsize (int, optional): Maximum number of connections kept alive per host. Default is 32.
+            max_retries (int, optional): Number of retries on transient errors. Default is 3.
+            backoff_factor (float, optional): Backoff factor between retries (0.3s, 0.6s, 1.2s, ...). Default is 0.3.
+            rate_limiter (KrakenRateLimiter, optional): The rate-limit scheduler. Default is the scheduler shared
+                                                        by all the transports, pass False to disable it.
+            recorder (LatencyRecorder, optional): The latency recorder. Default is the recorder shared by all
+                                                  the Kraken clients.
+        """
+        if base_url is None:
+            base_url = os.environ.get("KRAKEN_API_URL", DEFAULT_API_URL)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        if rate_limiter is None:
+            rate_limiter = get_default_rate_limiter()
+        self.rate_limiter = rate_limiter or None
+        self.recorder = recorder if recorder is not None else get_default_recorder()
+
+        # Retry on connection errors and on the status codes Kraken returns when it is overloaded.
+        # The read errors and the error statuses are only retried for GET: a POST may have been executed
+        # by Kraken before the error (e.g. an order placed, then a 502 from the proxy), and a replay is not
+        # guaranteed to be rejected for its nonce when the API key has a nonce window. urllib3 retries the
+        # connection errors of every method, since the request was never sent.
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504, 520, 522),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, uri_path):
+        """
+        Build the full URL for a URI path (e.g. '/0/public/OHLC').
+        """
+        return self.base_url + uri_path
+
+    def get(self, uri_path, params=None, priority=None):
+        """
+        Sends a GET request to the Kraken API.
+
+        Parameters:
+            uri_path (str): The API endpoint URI path.
+            params (dict, optional): The query string parameters.
+            priority (int, optional): Priority of the request in the rate-limit queue, lower is served first.
+
+        Returns:
+            requests.Response: The response from the Kraken API.
+        """
+        if self.rate_limiter is not None:
+            start = time.perf_counter_ns()
+            self.rate_limiter.acquire(uri_path, priority)
+            self.recorder.record(uri_path, "rate_limit", start)
+        start = time.perf_counter_ns()
+        response = self.session.get(self.url(uri_path), params=params, timeout=self.timeout)
+        self.recorder.record(uri_path, "network", start)
+        return response
+
+    def post(self, uri_path, headers=None, data=None, priority=None, sign=None):
+        """
+        Sends a POST request to the Kraken API.
+
+        Parameters:
+            uri_path (str): The API endpoint URI path.
+            headers (dict, optional): The headers for the API request.
+            data (dict, optional): The data payload for the API request.
+            priority (int, optional): Priority of the request in the rate-limit queue, lower is served first.
+            sign (callable, optional): Returns the headers and the body of a private request. It is called once
+                                       the rate limiter lets the request through, so that the nonces are taken
+                                       in the order the requests are sent, whatever their priority.
+
+        Returns:
+            requests.Response: The response from the Kraken API.
+        """
+        if self.rate_limiter is not None:
+            start = time.perf_counter_ns()
+            self.rate_limiter.acquire(uri_path, priority)
+            self.recorder.record(uri_path, "rate_limit", start)
+        if sign is not None:
+            signed_headers, data = sign()
+            headers = {**headers, **signed_headers} if headers else signed_headers
+        start = time.perf_counter_ns()
+        response = self.session.post(self.url(uri_path), headers=headers, data=data, timeout=self.timeout)
+        self.recorder.record(uri_path, "network", start)
+        return response
+
+    def close(self):
+        """
+        Closes all the pooled connections.
+        """
+        self.session.close()
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport():
+    """
+    Returns the KrakenTransport shared by all the Kraken clients, creating it on first use.
+
+    Returns:
+        KrakenTransport: The shared transport.
+    """
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = KrakenTransport()
+        return _default_transport
+
+
+def set_default_transport(transport):
+    """
+    Replaces the shared transport, e.g. to point all the clients at a local stub server.
+
+    Parameters:
+        transport (KrakenTransport): The transport to share between the clients.
+    """
+    global _default_transport
+    with _default_transport_lock:
+        _default_transport = transport
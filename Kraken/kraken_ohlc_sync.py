@@ -0,0 +1,102 @@
+import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from kraken_api_market_data import KrakenAPIMarketData
+from kraken_store import KrakenStore
+
+
+class KrakenOHLCSync:
+    """
+    Keeps a local OHLC history up to date using the 'last' cursor returned by Kraken.
+
+    A watermark is stored in the KrakenStore for each (pair, interval): every sync only requests the
+    candles after the watermark and merges them into the stored history, replacing the candle that was
+    still in progress during the previous sync. A resync therefore costs one small request per pair.
+
+    Attributes:
+        market_data (KrakenAPIMarketData): The client used to download the candles.
+        store (KrakenStore): The store containing the history and the watermarks.
+        failed_pairs (dict): The pairs that failed during the last sync, with their error.
+
+    Methods:
+        sync(list_pairs, interval, max_workers):
+            Downloads the new candles of each pair and merges them into the stored history.
+
+        load_history(pair, interval):
+            Returns the stored history of a pair.
+    """
+    def __init__(self, market_data=None, store=None):
+        """
+        Initializes the KrakenOHLCSync class.
+
+        Parameters:
+            market_data (KrakenAPIMarketData, optional): The client used to download the candles, it must have
+                                                         a store. Default is a new KrakenAPIMarketData.
+            store (KrakenStore, optional): The store used when market_data is not given. Default is a new KrakenStore.
+        """
+        if market_data is None:
+            market_data = KrakenAPIMarketData(store=store if store is not None else KrakenStore())
+        elif market_data.store is None:
+            raise ValueError("market_data needs a store to be synced")
+        self.market_data = market_data
+        self.store = market_data.store
+        self.failed_pairs = {}
+
+    def load_history(self, pair, interval=None):
+        """
+        Returns the stored history of a pair.
+
+        Parameters:
+            pair (str): The asset pair.
+            interval (int, optional): The time interval in minutes. Default is the interval of market_data.
+
+        Returns:
+            pd.DataFrame: The stored candles sorted by timestamp, or None if the pair was never synced.
+        """
+        if interval is None:
+            interval = self.market_data.interval
+        return self.store.read_ohlc(pair, interval)
+
+    def sync(self, list_pairs, interval=None, max_workers=None):
+        """
+        Downloads the candles committed after the watermark of each pair and merges them into the stored history.
+
+        Pairs that were never synced are downloaded from market_data.since.
+
+        Parameters:
+            list_pairs (list): A list of asset pairs to sync.
+            interval (int, optional): The time interval in minutes. Default is the interval of market_data.
+            max_workers (int, optional): Maximum number of requests sent in parallel. Default is the
+                                         max_workers of market_data.
+
+        Returns:
+            dict: The number of candles downloaded for each pair that was synced successfully.
+        """
+        if interval is None:
+            interval = self.market_data.interval
+        if max_workers is None:
+            max_workers = self.market_data.max_workers
+
+        new_rows = {}
+        self.failed_pairs = {}
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(self.market_data._sync_ohlc_pair, pair, interval, self.market_data.since): pair
+                       for pair in list_pairs}
+            for future in as_completed(futures):
+                pair = futures[future]
+                try:
+                    new_rows[pair] = future.result()
+                except (requests.exceptions.RequestException, ValueError, KeyError, StopIteration) as e:
+                    print(f"An error occurred for {pair}: {e!r}")
+                    self.failed_pairs[pair] = e
+        return new_rows
+
+
+if __name__ == "__main__":
+    ohlc_sync = KrakenOHLCSync()
+
+    list_pairs = ["XXBTZEUR", "1INCHUSD", "AAVEETH", "AAVEEUR"]
+    print("\nSync historical data")
+    print(ohlc_sync.sync(list_pairs))
+
+    print("\nStored history")
+    print(ohlc_sync.load_history("XXBTZEUR"))
@@ -0,0 +1,263 @@
+import zlib
+import numpy as np
+
+
+class BookSide:
+    """
+    One side of an L2 order book, kept sorted in fixed-size NumPy arrays.
+
+    The levels are sorted from the best price: ascending for the asks, descending for the bids (stored
+    as negative keys so that both sides are searched in ascending order). The price and volume strings
+    sent by Kraken are kept as well, since the checksum is computed on them.
+
+    Attributes:
+        depth (int): Maximum number of levels kept.
+        size (int): Current number of levels.
+        keys (np.ndarray): The sort keys, price for the asks and -price for the bids.
+        volumes (np.ndarray): The volume of each level.
+    """
+    def __init__(self, depth, is_bid):
+        self.depth = depth
+        self.sign = -1.0 if is_bid else 1.0
+        self.size = 0
+        # One spare slot to insert a level before the worst one is dropped
+        self.keys = np.empty(depth + 1, dtype='f8')
+        self.volumes = np.empty(depth + 1, dtype='f8')
+        self.price_strings = np.empty(depth + 1, dtype=object)
+        self.volume_strings = np.empty(depth + 1, dtype=object)
+
+    @property
+    def prices(self):
+        """
+        The prices of the levels, best first (a new array: the keys are stored negated for the bids).
+        """
+        return self.sign * self.keys[:self.size]
+
+    def clear(self):
+        self.size = 0
+
+    def update(self, price, volume):
+        """
+        Applies one level update: a zero volume removes the level, otherwise it is inserted or replaced.
+
+        Parameters:
+            price (str): The price of the level, as sent by Kraken.
+            volume (str): The new volume of the level, as sent by Kraken.
+        """
+        key = self.sign * float(price)
+        size = self.size
+        i = int(np.searchsorted(self.keys[:size], key))
+        found = i < size and self.keys[i] == key
+        if float(volume) == 0:
+            if found:
+                for array in (self.keys, self.volumes, self.price_strings, self.volume_strings):
+                    array[i:size - 1] = array[i + 1:size]
+                self.size -= 1
+        elif found:
+            self.volumes[i] = float(volume)
+            self.volume_strings[i] = volume
+        elif i < self.depth:
+            for array in (self.keys, self.volumes, self.price_strings, self.volume_strings):
+                array[i + 1:size + 1] = array[i:size]
+            self.keys[i] = key
+            self.volumes[i] = float(volume)
+            self.price_strings[i] = price
+            self.volume_strings[i] = volume
+            self.size = min(size + 1, self.depth)
+
+    def vwap_to_fill(self, volume):
+        """
+        Returns the average price paid to fill a volume by walking the levels, or NaN if the book is too thin.
+        Raises a ValueError if the volume is not positive.
+        """
+        if not volume > 0:
+            raise ValueError(f"The volume to fill must be positive, got {volume}")
+        volumes = self.volumes[:self.size]
+        cumulated = np.cumsum(volumes)
+        i = int(np.searchsorted(cumulated, volume))
+        if i >= self.size:
+            return np.nan
+        prices = self.prices
+        filled_before = cumulated[i - 1] if i > 0 else 0.0
+        cost = prices[:i] @ volumes[:i] + prices[i] * (volume - filled_before)
+        return cost / volume
+
+    def checksum_string(self, levels=10):
+        return "".join(price.replace('.', '').lstrip('0') + volume.replace('.', '').lstrip('0')
+                       for price, volume in zip(self.price_strings[:min(levels, self.size)],
+                                                self.volume_strings[:min(levels, self.size)]))
+
+
+class KrakenOrderBook:
+    """
+    An L2 order book for one pair, maintained from the snapshot and updates of Kraken's 'book' channel.
+
+    Attributes:
+        pair (str): The pair of the book.
+        depth (int): Number of levels kept on each side, it must match the depth of the subscription.
+        asks (BookSide): The ask side, best (lowest) price first.
+        bids (BookSide): The bid side, best (highest) price first.
+        valid (bool): False once a checksum did not match: the book must be subscribed to again.
+        updates (int): Number of messages applied.
+
+    Methods:
+        apply(data):
+            Applies the data of a snapshot or update message.
+
+        best_bid() / best_ask():
+            Returns the best price and its volume.
+
+        depth_levels(n):
+            Returns the n best levels of each side.
+
+        vwap_to_fill(side, volume):
+            Returns the average price of a market order of the given volume.
+    """
+    def __init__(self, pair=None, depth=10):
+        self.pair = pair
+        self.depth = depth
+        self.asks = BookSide(depth, is_bid=False)
+        self.bids = BookSide(depth, is_bid=True)
+        self.valid = True
+        self.updates = 0
+
+    def apply(self, *data):
+        """
+        Applies the data of a book message.
+
+        Parameters:
+            *data (dict): The dicts of the message: {'as': [...], 'bs': [...]} for a snapshot, or one or two
+                          dicts with 'a' and/or 'b' levels and the 'c' checksum for an update.
+
+        Returns:
+            bool: False if the checksum of the message did not match the book.
+        """
+        checksum = None
+        for part in data:
+            if 'as' in part or 'bs' in part:
+                self.asks.clear()
+                self.bids.clear()
+            for key, side in (('as', self.asks), ('bs', self.bids), ('a', self.asks), ('b', self.bids)):
+                for level in part.get(key, ()):
+                    side.update(level[0], level[1])
+            checksum = part.get('c', checksum)
+
+        self.updates += 1
+        if checksum is not None and int(checksum) != self.checksum():
+            self.valid = False
+        return self.valid
+
+    def checksum(self):
+        """
+        Returns Kraken's CRC32 checksum of the 10 best levels of each side.
+        """
+        return zlib.crc32((self.asks.checksum_string() + self.bids.checksum_string()).encode())
+
+    def best_bid(self):
+        """
+        Returns the best bid price and its volume, or (NaN, NaN) if the side is empty.
+        """
+        if self.bids.size == 0:
+            return np.nan, np.nan
+        return -self.bids.keys[0], self.bids.volumes[0]
+
+    def best_ask(self):
+        """
+        Returns the best ask price and its volume, or (NaN, NaN) if the side is empty.
+        """
+        if self.asks.size == 0:
+            return np.nan, np.nan
+        return self.asks.keys[0], self.asks.volumes[0]
+
+    def depth_levels(self, n=None):
+        """
+        Returns the n best levels of each side.
+
+        Returns:
+            tuple: The bids and the asks, each a tuple of (prices, volumes) arrays, best first.
+        """
+        n = self.depth if n is None else n
+        return ((self.bids.prices[:n], self.bids.volumes[:min(n, self.bids.size)]),
+                (self.asks.prices[:n], self.asks.volumes[:min(n, self.asks.size)]))
+
+    def vwap_to_fill(self, side, volume):
+        """
+        Returns the average price of a market order of the given volume, or NaN if the book is too thin.
+
+        Parameters:
+            side (str): 'buy' (walks the asks) or 'sell' (walks the bids).
+            volume (float): The volume of the order in the base asset, a ValueError is raised if it is not positive.
+        """
+        return (self.asks if side == 'buy' else self.bids).vwap_to_fill(volume)
+
+
+class KrakenOrderBooks:
+    """
+    The order books of several pairs, fed by the messages of KrakenWSMarketData.
+
+    An instance is a listener: append it to KrakenWSMarketData.listeners, with a 'book' subscription.
+
+    Attributes:
+        depth (int): Number of levels kept on each side, it must match the depth of the subscription.
+        books (dict): The KrakenOrderBook of each pair.
+    """
+    def __init__(self, depth=10):
+        self.depth = depth
+        self.books = {}
+
+    def __getitem__(self, pair):
+        return self.books[pair]
+
+    def __call__(self, message):
+        # Book messages are [channelID, data, channelName, pair] or, when both sides are updated,
+        # [channelID, asks, bids, channelName, pair]
+        if not isinstance(message, list) or not message[-2].startswith('book'):
+            return
+        pair = message[-1]
+        book = self.books.get(pair)
+        if book is None:
+            book = self.books[pair] = KrakenOrderBook(pair, self.depth)
+        book.apply(*message[1:-2])
+
+
+def _synthetic_messages(n, depth, seed=0):
+    rng = np.random.default_rng(seed)
+    mid = 30000.0
+    levels = np.round(mid + np.arange(1, depth + 1) * 0.1, 1)
+    messages = [[1, {'as': [[f"{p:.1f}", "1.00000000", "0"] for p in levels],
+                     'bs': [[f"{p - depth * 0.1 - 0.1:.1f}", "1.00000000", "0"] for p in levels]},
+                 f"book-{depth}", "XBT/USD"]]
+    offsets = rng.integers(1, depth + 5, size=n)
+    volumes = rng.random(n) * (rng.random(n) > 0.2)
+    sides = rng.random(n) > 0.5
+    for offset, volume, is_ask in zip(offsets, volumes, sides):
+        price = mid + offset * 0.1 if is_ask else mid - offset * 0.1
+        messages.append([1, {('a' if is_ask else 'b'): [[f"{price:.1f}", f"{volume:.8f}", "0"]]},
+                         f"book-{depth}", "XBT/USD"])
+    return messages
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+    import time
+
+    # Replay recorded messages (one JSON message per line, e.g. written by a KrakenWSMarketData listener)
+    # or synthetic updates, and report the number of updates applied per second
+    depth = 10
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'r') as file:
+            messages = [json.loads(line) for line in file]
+    else:
+        messages = _synthetic_messages(200000, depth)
+
+    books = KrakenOrderBooks(depth)
+    start = time.perf_counter()
+    for message in messages:
+        books(message)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(messages)} messages in {elapsed:.3f}s: {len(messages) / elapsed:,.0f} updates/s")
+    for pair, book in books.books.items():
+        print(f"{pair}: bid {book.best_bid()}, ask {book.best_ask()}, valid {book.valid}, "
+              f"vwap to buy 1: {book.vwap_to_fill('buy', 1):.2f}")
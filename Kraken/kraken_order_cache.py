@@ -0,0 +1,90 @@
+import json
+import os
+import sqlite3
+import threading
+
+# The status of the orders which can no longer change
+FINAL_STATUSES = ("closed", "canceled", "expired")
+
+
+class KrakenOrderCache:
+    """
+    A persistent cache of the orders which can no longer change (closed, canceled or expired).
+
+    The orders are kept in a SQLite file as JSON, keyed by txid. The file is only opened on first use.
+
+    Attributes:
+        path (str): The path of the SQLite file.
+
+    Methods:
+        get_many(txids):
+            Returns the cached orders among the txids.
+
+        put_many(orders):
+            Caches the orders which can no longer change, and ignores the other ones.
+    """
+    def __init__(self, path=os.path.join("Kraken_Store", "orders_cache.sqlite")):
+        """
+        Initializes the KrakenOrderCache class.
+
+        Parameters:
+            path (str, optional): The path of the SQLite file. Default is 'Kraken_Store/orders_cache.sqlite'.
+        """
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS orders (txid TEXT PRIMARY KEY, info TEXT NOT NULL)")
+        return self._connection
+
+    def get_many(self, txids):
+        """
+        Returns the cached orders among the txids.
+
+        Parameters:
+            txids (list): The transaction IDs of the orders.
+
+        Returns:
+            dict: The information of each cached order, keyed by txid.
+        """
+        orders = {}
+        txids = list(txids)
+        with self._lock:
+            connection = self._connect()
+            # SQLite limits the number of parameters of a query
+            for i in range(0, len(txids), 500):
+                chunk = txids[i:i + 500]
+                rows = connection.execute(f"SELECT txid, info FROM orders WHERE txid IN ({','.join('?' * len(chunk))})",
+                                          chunk)
+                orders.update((txid, json.loads(info)) for txid, info in rows)
+        return orders
+
+    def put_many(self, orders):
+        """
+        Caches the orders which can no longer change, and ignores the other ones.
+
+        Parameters:
+            orders (dict): The information of each order, keyed by txid, as returned by QueryOrders.
+
+        Returns:
+            int: The number of orders cached.
+        """
+        rows = [(txid, json.dumps(info)) for txid, info in orders.items() if info.get("status") in FINAL_STATUSES]
+        if rows:
+            with self._lock:
+                connection = self._connect()
+                with connection:
+                    connection.executemany("INSERT OR REPLACE INTO orders (txid, info) VALUES (?, ?)", rows)
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
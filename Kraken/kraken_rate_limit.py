@@ -0,0 +1,215 @@
+import heapq
+import itertools
+import threading
+import time
+
+# Kraken's call counters, per verification tier: maximum value of the counter and how much it decays per second.
+# https://docs.kraken.com/rest/#section/Rate-Limits
+PRIVATE_LIMITS = {
+    "starter": (15, 0.33),
+    "intermediate": (20, 0.5),
+    "pro": (20, 1.0),
+}
+
+# Order placement/cancellation does not affect the private counter, it has its own counter.
+TRADING_LIMITS = {
+    "starter": (60, 1.0),
+    "intermediate": (125, 2.34),
+    "pro": (180, 3.75),
+}
+
+# Public endpoints are limited per IP address to roughly one call per second, with a small burst allowed.
+PUBLIC_LIMIT = (15, 1.0)
+
+# Ledger and trade history calls increase the private counter by 2, the other private calls by 1
+HISTORY_ENDPOINTS = {"TradesHistory", "ClosedOrders", "Ledgers", "QueryLedgers", "QueryTrades"}
+TRADING_ENDPOINTS = {"AddOrder", "AddOrderBatch", "EditOrder", "CancelOrder", "CancelOrderBatch", "CancelAll",
+                     "CancelAllOrdersAfter"}
+
+# Lower values are served first: order placement goes ahead of account queries, and history pulls go last
+PRIORITIES = {
+    "trading": 0,
+    "private": 1,
+    "public": 2,
+    "history": 3,
+}
+
+
+def endpoint_category(uri_path):
+    """
+    Returns the rate-limit category of a Kraken API endpoint.
+
+    Parameters:
+        uri_path (str): The API endpoint URI path (e.g. '/0/private/AddOrder').
+
+    Returns:
+        str: One of 'public', 'private', 'history' or 'trading'.
+    """
+    method = uri_path.rstrip("/").rsplit("/", 1)[-1]
+    if "/public/" in uri_path:
+        return "public"
+    if method in TRADING_ENDPOINTS:
+        return "trading"
+    if method in HISTORY_ENDPOINTS:
+        return "history"
+    return "private"
+
+
+class TokenBucket:
+    """
+    A token bucket mirroring one of Kraken's call counters.
+
+    The bucket holds capacity - counter tokens: each call takes its cost in tokens, and the tokens
+    come back at the decay rate of the counter.
+
+    Attributes:
+        capacity (float): Maximum number of tokens, i.e. the maximum value of Kraken's counter.
+        rate (float): Number of tokens added back per second, i.e. the decay of Kraken's counter.
+        tokens (float): Number of tokens currently available.
+    """
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, cost, now):
+        """
+        Takes cost tokens if they are available.
+
+        Parameters:
+            cost (float): Number of tokens needed by the call.
+            now (float): Current time.monotonic() value.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the number of seconds until they are available.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class KrakenRateLimiter:
+    """
+    A client-side scheduler that keeps the requests within Kraken's rate limits.
+
+    Requests wait in a priority queue until their bucket has enough tokens, so that bursts are spread
+    out instead of being rejected with "EAPI:Rate limit exceeded". Only the requests sent from this
+    process are counted: jobs running in other processes with the same API key should use a lower tier.
+
+    Attributes:
+        buckets (dict): The token bucket of each counter ('public', 'private' and 'trading').
+
+    Methods:
+        acquire(uri_path, priority, cost):
+            Blocks until the request can be sent and returns how long it waited.
+
+        stats():
+            Returns the number of requests and the time they waited in the queue, per category.
+    """
+    def __init__(self, tier="starter"):
+        """
+        Initializes the KrakenRateLimiter class.
+
+        Parameters:
+            tier (str, optional): The verification tier of the account: 'starter', 'intermediate' or 'pro'.
+                                  Default is 'starter'.
+        """
+        self.buckets = {
+            "public": TokenBucket(*PUBLIC_LIMIT),
+            "private": TokenBucket(*PRIVATE_LIMITS[tier]),
+            "trading": TokenBucket(*TRADING_LIMITS[tier]),
+        }
+        self._queues = {name: [] for name in self.buckets}
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+        self._stats = {category: {"count": 0, "wait_total": 0.0, "wait_max": 0.0} for category in PRIORITIES}
+
+    def acquire(self, uri_path, priority=None, cost=None):
+        """
+        Blocks until the request can be sent without exceeding the rate limit.
+
+        Parameters:
+            uri_path (str): The API endpoint URI path.
+            priority (int, optional): Lower values are served first. Default depends on the endpoint category.
+            cost (float, optional): Number of tokens used by the request. Default depends on the endpoint category.
+
+        Returns:
+            float: The number of seconds the request waited in the queue.
+        """
+        category = endpoint_category(uri_path)
+        if priority is None:
+            priority = PRIORITIES[category]
+        if cost is None:
+            cost = 2 if category == "history" else 1
+        bucket_name = "private" if category == "history" else category
+        bucket = self.buckets[bucket_name]
+        queue = self._queues[bucket_name]
+
+        start = time.monotonic()
+        entry = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(queue, entry)
+            while True:
+                if queue[0] == entry:
+                    delay = bucket.take(cost, time.monotonic())
+                    if delay == 0:
+                        heapq.heappop(queue)
+                        self._condition.notify_all()
+                        break
+                    self._condition.wait(delay)
+                else:
+                    self._condition.wait()
+
+            waited = time.monotonic() - start
+            stats = self._stats[category]
+            stats["count"] += 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+        return waited
+
+    def stats(self):
+        """
+        Returns the number of requests and the time they waited in the queue, per category.
+
+        Returns:
+            dict: For each category, the count of requests and the total, mean and max wait in seconds.
+        """
+        with self._condition:
+            return {
+                category: dict(values, wait_mean=values["wait_total"] / values["count"] if values["count"] else 0.0)
+                for category, values in self._stats.items()
+            }
+
+
+_default_rate_limiter = None
+_default_rate_limiter_lock = threading.Lock()
+
+
+def get_default_rate_limiter():
+    """
+    Returns the KrakenRateLimiter shared by all the Kraken clients, creating it on first use.
+
+    Returns:
+        KrakenRateLimiter: The shared rate limiter.
+    """
+    global _default_rate_limiter
+    with _default_rate_limiter_lock:
+        if _default_rate_limiter is None:
+            _default_rate_limiter = KrakenRateLimiter()
+        return _default_rate_limiter
+
+
+if __name__ == "__main__":
+    # Simulate a burst of requests from several threads and print the time they waited
+    rate_limiter = KrakenRateLimiter(tier="pro")
+    paths = ["/0/private/TradesHistory"] * 6 + ["/0/private/AddOrder"] * 5 + ["/0/private/Balance"] * 12
+    threads = [threading.Thread(target=rate_limiter.acquire, args=(path,)) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(rate_limiter.stats())
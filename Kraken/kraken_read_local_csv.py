@@ -1,25 +1,224 @@
+import os
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from kraken_store import KrakenStore
 
 # Define the chunk size (adjust as needed)
 chunksize = 10000
 
-pair_name = "AAVEUSD"
+# Kraken's trading history files have no header: one trade per line
+TRADE_COLUMNS = ['timestamp', 'price', 'volume']
+TRADE_DTYPES = {'timestamp': 'int64', 'price': 'float64', 'volume': 'float64'}
 
-# Open the CSV file using with open
-file_name = f"Kraken_Trading_History/{pair_name}.csv"
+BAR_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count']
 
-# we read in chunks to do it fast
-with open(file_name,'r') as file:
-    # Create an empty list to store the chunks
-    chunks = []
+# Aggregation used to merge partial bars, 'pv' is the sum of price * volume used to compute the vwap
+BAR_AGGREGATION = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum', 'pv': 'sum',
+                   'count': 'sum'}
 
-    # Iterate over the file in chunks
-    for chunk in pd.read_csv(file, chunksize=chunksize):
-        # Process the chunk as needed
-        chunks.append(chunk)
 
-# Concatenate the chunks into a single DataFrame
-df = pd.concat(chunks)
+def iter_trade_chunks(pair_name, chunksize=chunksize, data_dir="Kraken_Trading_History"):
+    """
+    Read the trading history of a pair in chunks.
 
-# Display the top 10 rows of the DataFrame
-print(df.head(10))
+    Only one chunk is held in memory at a time, whatever the size of the file.
+
+    Parameters:
+        pair_name (str): The asset pair (e.g. 'AAVEUSD'), the file read is <data_dir>/<pair_name>.csv.
+        chunksize (int, optional): Number of trades per chunk. Default is 10000.
+        data_dir (str, optional): The directory containing the trading history files.
+
+    Yields:
+        pd.DataFrame: Chunks of trades with the columns timestamp, price and volume.
+    """
+    file_name = os.path.join(data_dir, f"{pair_name}.csv")
+    with open(file_name, 'r') as file:
+        yield from pd.read_csv(file, chunksize=chunksize, header=None, names=TRADE_COLUMNS, dtype=TRADE_DTYPES)
+
+
+def _finalize_bars(bars):
+    bars = bars.assign(vwap=bars['pv'] / bars['volume'])
+    bars.index.name = 'timestamp'
+    return bars.reset_index()[BAR_COLUMNS]
+
+
+def stream_ohlcv(chunks, interval):
+    """
+    Turn a stream of trades into OHLCV bars.
+
+    The trades must be sorted by timestamp, as they are in Kraken's files. The last bar of each chunk
+    may continue in the next chunk, so it is only yielded once the next bar starts.
+
+    Parameters:
+        chunks (iterable): Chunks of trades, e.g. from iter_trade_chunks().
+        interval (int): The time interval of the bars in minutes.
+
+    Yields:
+        pd.DataFrame: The completed bars of each chunk, with the columns timestamp, open, high, low, close,
+                      vwap, volume and count.
+    """
+    step = interval * 60
+    pending = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        bucket = chunk['timestamp'].to_numpy() // step * step
+        chunk = chunk.assign(bucket=bucket, pv=chunk['price'] * chunk['volume'])
+        bars = chunk.groupby('bucket', sort=True).agg(
+            open=('price', 'first'), high=('price', 'max'), low=('price', 'min'), close=('price', 'last'),
+            volume=('volume', 'sum'), pv=('pv', 'sum'), count=('price', 'size'))
+
+        # Complete the bar left over by the previous chunk
+        if pending is not None:
+            bars = pd.concat([pending, bars]).groupby(level=0, sort=True).agg(BAR_AGGREGATION)
+
+        pending = bars.iloc[-1:]
+        if len(bars) > 1:
+            yield _finalize_bars(bars.iloc[:-1])
+
+    if pending is not None:
+        yield _finalize_bars(pending)
+
+
+class TradeStatistics:
+    """
+    Statistics of the trades of a pair, updated one chunk at a time.
+
+    Attributes:
+        count (int): Number of trades.
+        volume (float): Total volume in the base asset.
+        notional (float): Total volume in the quote asset (sum of price * volume).
+        min_price (float): Lowest price.
+        max_price (float): Highest price.
+        first_timestamp (int): Timestamp of the first trade.
+        last_timestamp (int): Timestamp of the last trade.
+    """
+    def __init__(self):
+        self.count = 0
+        self.volume = 0.0
+        self.notional = 0.0
+        self.min_price = np.inf
+        self.max_price = -np.inf
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def update(self, chunk):
+        """
+        Adds a chunk of trades to the statistics.
+        """
+        if chunk.empty:
+            return
+        price = chunk['price'].to_numpy()
+        volume = chunk['volume'].to_numpy()
+        self.count += len(chunk)
+        self.volume += volume.sum()
+        self.notional += price @ volume
+        self.min_price = min(self.min_price, price.min())
+        self.max_price = max(self.max_price, price.max())
+        if self.first_timestamp is None:
+            self.first_timestamp = int(chunk['timestamp'].iloc[0])
+        self.last_timestamp = int(chunk['timestamp'].iloc[-1])
+
+    def to_dict(self):
+        """
+        Returns the statistics as a dictionary, with the vwap and the mean trade size.
+        """
+        return {
+            'count': self.count,
+            'volume': self.volume,
+            'notional': self.notional,
+            'vwap': self.notional / self.volume if self.volume else np.nan,
+            'mean_trade_volume': self.volume / self.count if self.count else np.nan,
+            'min_price': self.min_price if self.count else np.nan,
+            'max_price': self.max_price if self.count else np.nan,
+            'first_timestamp': self.first_timestamp,
+            'last_timestamp': self.last_timestamp,
+        }
+
+
+def _month_start(timestamp):
+    # The first second of the month of a timestamp, the store partitions the bars by month
+    return int(pd.Timestamp(timestamp, unit='s').to_period('M').start_time.timestamp())
+
+
+def process_pair(pair_name, interval, chunksize=chunksize, data_dir="Kraken_Trading_History", store_root=None,
+                 return_bars=None):
+    """
+    Compute the OHLCV bars and the statistics of a pair in a single pass over its trading history.
+
+    Parameters:
+        pair_name (str): The asset pair.
+        interval (int): The time interval of the bars in minutes.
+        chunksize (int, optional): Number of trades read at a time. Default is 10000.
+        data_dir (str, optional): The directory containing the trading history files.
+        store_root (str, optional): When given, the bars are written to the KrakenStore in this directory as
+                                    they are computed, one month at a time, and only that month is kept in memory.
+        return_bars (bool, optional): Whether to return the bars. Default is True without store_root, False with it.
+
+    Returns:
+        tuple: The bars (pd.DataFrame, None when not returned) and the statistics (dict) of the pair.
+    """
+    if return_bars is None:
+        return_bars = store_root is None
+    statistics = TradeStatistics()
+    store = KrakenStore(store_root) if store_root is not None else None
+
+    def chunks():
+        for chunk in iter_trade_chunks(pair_name, chunksize, data_dir):
+            statistics.update(chunk)
+            yield chunk
+
+    bars = []       # the bars returned, much smaller than the trades: concatenated once at the end
+    pending = []    # the bars of the current month, not written to the store yet
+    for frame in stream_ohlcv(chunks(), interval):
+        if frame.empty:
+            continue
+        if return_bars:
+            bars.append(frame)
+        if store is None:
+            continue
+        pending.append(frame)
+        # A month is written once the bars of the next month start, so each month file is written once
+        month_start = _month_start(frame['timestamp'].iloc[-1])
+        if pending[0]['timestamp'].iloc[0] < month_start:
+            pending = pd.concat(pending, ignore_index=True)
+            done = pending['timestamp'] < month_start
+            store.write_ohlc(pair_name, interval, pending[done])
+            pending = [pending[~done]]
+    if pending:
+        store.write_ohlc(pair_name, interval, pd.concat(pending, ignore_index=True))
+
+    if not return_bars:
+        return None, statistics.to_dict()
+    bars = pd.concat(bars, ignore_index=True) if bars else pd.DataFrame(columns=BAR_COLUMNS)
+    return bars, statistics.to_dict()
+
+
+def process_pairs(pair_names, interval, processes=None, **kwargs):
+    """
+    Run process_pair() for several pairs in parallel, one process per pair.
+
+    Parameters:
+        pair_names (list): The asset pairs.
+        interval (int): The time interval of the bars in minutes.
+        processes (int, optional): Number of worker processes. Default is the number of CPUs.
+        **kwargs: The other arguments of process_pair().
+
+    Returns:
+        dict: The bars and the statistics of each pair, as returned by process_pair().
+    """
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {pair_name: executor.submit(process_pair, pair_name, interval, **kwargs) for pair_name in pair_names}
+        return {pair_name: future.result() for pair_name, future in futures.items()}
+
+
+if __name__ == "__main__":
+    pair_name = "AAVEUSD"
+
+    # Build the daily bars with only one chunk of trades in memory at a time
+    bars, statistics = process_pair(pair_name, interval=1440)
+
+    # Display the top 10 bars and the statistics of the pair
+    print(bars.head(10))
+    print(statistics)
@@ -0,0 +1,286 @@
+import glob
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from kraken_decode import OHLC_DTYPES
+
+
+class KrakenStore:
+    """
+    A local columnar store for Kraken OHLC and trade data.
+
+    The data is kept in Parquet files partitioned by pair, interval and month, e.g.
+    'ohlc/pair=XXBTZEUR/interval=1440/month=2023-08/part-0.parquet'. A range query only reads the
+    months it overlaps, and the partitions already read are kept in memory (memory-mapped Arrow tables)
+    until their file changes, so repeated backtests and notebook runs do not touch the network or parse text.
+
+    Attributes:
+        root (str): The directory containing the store.
+        watermarks (dict): The sync cursor of each dataset, e.g. the 'last' cursor of each (pair, interval).
+
+    Methods:
+        write_ohlc(pair, interval, df):
+            Merges OHLC candles into the store, replacing the stored candles with the same timestamp.
+
+        read_ohlc(pair, interval, start, end, columns):
+            Reads the OHLC candles of a pair between two timestamps.
+
+        write_trades(pair, df):
+            Appends trades to the store.
+
+        read_trades(pair, start, end, columns):
+            Reads the trades of a pair between two timestamps.
+
+        write_history(dataset, df, time_col, unique_key):
+            Merges account history (trades history, closed orders) into the store.
+
+        read_history(dataset, start, end, columns, time_col):
+            Reads account history between two timestamps.
+
+        get_watermark(key) / set_watermark(key, value):
+            Reads/updates the sync cursor of a dataset.
+    """
+    def __init__(self, root="Kraken_Store", cache_size=256):
+        """
+        Initializes the KrakenStore class.
+
+        Parameters:
+            root (str, optional): The directory containing the store. Default is 'Kraken_Store'.
+            cache_size (int, optional): Maximum number of partitions kept in memory. Default is 256.
+        """
+        self.root = root
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._watermarks_path = os.path.join(root, "watermarks.json")
+        self.watermarks = {}
+        if os.path.exists(self._watermarks_path):
+            with open(self._watermarks_path, 'r') as file:
+                self.watermarks = json.load(file)
+
+    # ---------------------------------------------------------------------------------------------
+    # Watermarks
+
+    def get_watermark(self, key, default=None):
+        """
+        Returns the sync cursor stored for a dataset, or default if there is none.
+        """
+        with self._lock:
+            return self.watermarks.get(key, default)
+
+    def set_watermark(self, key, value):
+        """
+        Stores the sync cursor of a dataset. It must be called once the data is written.
+        """
+        with self._lock:
+            self.watermarks[key] = value
+            # Write to a temporary file first so that an interrupted run never leaves a truncated file
+            tmp_path = f"{self._watermarks_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w') as file:
+                json.dump(self.watermarks, file, indent=1, sort_keys=True)
+            os.replace(tmp_path, self._watermarks_path)
+
+    # ---------------------------------------------------------------------------------------------
+    # Partitions
+
+    def _dataset_dir(self, kind, **keys):
+        parts = [self.root, kind] + [f"{name}={value}" for name, value in keys.items()]
+        return os.path.join(*parts)
+
+    @staticmethod
+    def _months(timestamps):
+        return pd.to_datetime(timestamps, unit='s').dt.strftime('%Y-%m')
+
+    def _read_file(self, path, columns=None):
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached is not None and cached[0] == mtime:
+                self._cache.move_to_end(path)
+                table = cached[1]
+                return table.select(columns) if columns else table
+
+        table = pq.read_table(path, memory_map=True)
+        with self._lock:
+            self._cache[path] = (mtime, table)
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return table.select(columns) if columns else table
+
+    def _write_file(self, path, df):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+        os.replace(tmp_path, path)
+
+    def _write(self, base_dir, df, time_col, unique_key=None):
+        """
+        Writes a DataFrame into monthly partitions.
+
+        With a unique_key, each month is merged with the stored rows (the new rows win) and rewritten
+        in a single file. Without one, the rows are appended to the month in a new file.
+        """
+        if df.empty:
+            return
+        for month, df_month in df.groupby(self._months(df[time_col]).values, sort=False):
+            month_dir = os.path.join(base_dir, f"month={month}")
+            os.makedirs(month_dir, exist_ok=True)
+            if unique_key is None:
+                self._write_file(os.path.join(month_dir, f"part-{uuid.uuid4().hex}.parquet"), df_month)
+                continue
+
+            paths = sorted(glob.glob(os.path.join(month_dir, "*.parquet")))
+            if paths:
+                df_stored = pa.concat_tables([self._read_file(path) for path in paths]).to_pandas()
+                df_month = pd.concat([df_stored, df_month], axis=0, ignore_index=True)
+                df_month = df_month.drop_duplicates(subset=unique_key, keep="last")
+            df_month = df_month.sort_values(time_col)
+            self._write_file(os.path.join(month_dir, "part-0.parquet"), df_month)
+            for path in paths:
+                if os.path.basename(path) != "part-0.parquet":
+                    os.remove(path)
+
+    def _read(self, base_dir, time_col, start=None, end=None, columns=None):
+        """
+        Reads the rows between two timestamps, opening only the months that overlap the range.
+        """
+        start_month = None if start is None else self._months(pd.Series([start])).iloc[0]
+        end_month = None if end is None else self._months(pd.Series([end])).iloc[0]
+
+        if columns is not None and time_col not in columns:
+            columns = [time_col] + list(columns)
+        tables = []
+        for month_dir in sorted(glob.glob(os.path.join(base_dir, "month=*"))):
+            month = month_dir.rsplit("=", 1)[-1]
+            if (start_month is not None and month < start_month) or (end_month is not None and month > end_month):
+                continue
+            for path in sorted(glob.glob(os.path.join(month_dir, "*.parquet"))):
+                tables.append(self._read_file(path, columns))
+        if not tables:
+            return None
+
+        if all(table.schema.equals(tables[0].schema) for table in tables):
+            df = pa.concat_tables(tables).to_pandas()
+        else:
+            # The columns of the history datasets can change from one month to the next
+            df = pd.concat([table.to_pandas() for table in tables], axis=0, ignore_index=True)
+        if start is not None:
+            df = df[df[time_col] >= start]
+        if end is not None:
+            df = df[df[time_col] <= end]
+        return df.reset_index(drop=True)
+
+    # ---------------------------------------------------------------------------------------------
+    # OHLC
+
+    def write_ohlc(self, pair, interval, df):
+        """
+        Merges OHLC candles into the store, replacing the stored candles with the same timestamp.
+
+        Parameters:
+            pair (str): The asset pair.
+            interval (int): The time interval in minutes.
+            df (pd.DataFrame): The candles, with the columns returned by KrakenAPIMarketData.get_historical_data.
+        """
+        df = df[list(OHLC_DTYPES)].astype(OHLC_DTYPES)
+        self._write(self._dataset_dir("ohlc", pair=pair, interval=interval), df, "timestamp", unique_key="timestamp")
+
+    def read_ohlc(self, pair, interval, start=None, end=None, columns=None):
+        """
+        Reads the OHLC candles of a pair between two timestamps (inclusive).
+
+        Parameters:
+            pair (str): The asset pair.
+            interval (int): The time interval in minutes.
+            start (int, optional): The first timestamp in seconds. Default is the beginning of the history.
+            end (int, optional): The last timestamp in seconds. Default is the end of the history.
+            columns (list, optional): The columns to read. Default is all the columns.
+
+        Returns:
+            pd.DataFrame: The candles sorted by timestamp, with a 'pair' column, or None if nothing is stored.
+        """
+        df = self._read(self._dataset_dir("ohlc", pair=pair, interval=interval), "timestamp", start, end, columns)
+        if df is not None:
+            df.insert(0, "pair", pair)
+        return df
+
+    # ---------------------------------------------------------------------------------------------
+    # Trades
+
+    def write_trades(self, pair, df, time_col="timestamp"):
+        """
+        Appends trades to the store.
+
+        Parameters:
+            pair (str): The asset pair.
+            df (pd.DataFrame): The trades, with a timestamp column in seconds.
+            time_col (str, optional): The name of the timestamp column. Default is 'timestamp'.
+        """
+        self._write(self._dataset_dir("trades", pair=pair), df, time_col)
+
+    def read_trades(self, pair, start=None, end=None, columns=None, time_col="timestamp"):
+        """
+        Reads the trades of a pair between two timestamps (inclusive).
+
+        Parameters:
+            pair (str): The asset pair.
+            start (float, optional): The first timestamp in seconds. Default is the beginning of the history.
+            end (float, optional): The last timestamp in seconds. Default is the end of the history.
+            columns (list, optional): The columns to read. Default is all the columns.
+            time_col (str, optional): The name of the timestamp column. Default is 'timestamp'.
+
+        Returns:
+            pd.DataFrame: The trades, or None if nothing is stored.
+        """
+        return self._read(self._dataset_dir("trades", pair=pair), time_col, start, end, columns)
+
+    # ---------------------------------------------------------------------------------------------
+    # Account history
+
+    def write_history(self, dataset, df, time_col, unique_key):
+        """
+        Merges account history into the store, replacing the stored rows with the same unique_key.
+
+        Parameters:
+            dataset (str): The name of the dataset (e.g. 'trades_history', 'closed_orders').
+            df (pd.DataFrame): The rows to write, with a timestamp column in seconds.
+            time_col (str): The name of the timestamp column used for the partitioning.
+            unique_key (str): The name of the column identifying a row (e.g. 'txid').
+        """
+        self._write(self._dataset_dir("history", dataset=dataset), df, time_col, unique_key=unique_key)
+
+    def read_history(self, dataset, start=None, end=None, columns=None, time_col="time"):
+        """
+        Reads account history between two timestamps (inclusive).
+
+        Parameters:
+            dataset (str): The name of the dataset (e.g. 'trades_history', 'closed_orders').
+            start (float, optional): The first timestamp in seconds. Default is the beginning of the history.
+            end (float, optional): The last timestamp in seconds. Default is the end of the history.
+            columns (list, optional): The columns to read. Default is all the columns.
+            time_col (str, optional): The name of the timestamp column. Default is 'time'.
+
+        Returns:
+            pd.DataFrame: The rows, or None if nothing is stored.
+        """
+        return self._read(self._dataset_dir("history", dataset=dataset), time_col, start, end, columns)
+
+
+if __name__ == "__main__":
+    import time
+
+    store = KrakenStore()
+    pair, interval = "XXBTZEUR", 1440
+    start = time.perf_counter()
+    df = store.read_ohlc(pair, interval)
+    print(f"First read: {1000 * (time.perf_counter() - start):.2f} ms")
+    start = time.perf_counter()
+    df = store.read_ohlc(pair, interval)
+    print(f"Cached read: {1000 * (time.perf_counter() - start):.2f} ms")
+    print(df)
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import numpy as np
+import websockets
+
+# URL of Kraken's public WebSocket API. It can be overridden with the KRAKEN_WS_URL environment variable
+# so that a local stand-in (see kraken_ws_stub.py) can be used in tests.
+DEFAULT_WS_URL = "wss://ws.kraken.com"
+
+# Layout of the records kept for each channel, 'time' is the exchange time in seconds (the time of
+# reception for the ticker, which has no timestamp)
+TICKER_DTYPE = np.dtype([('time', 'f8'), ('bid', 'f8'), ('bid_volume', 'f8'), ('ask', 'f8'), ('ask_volume', 'f8'),
+                         ('last', 'f8'), ('last_volume', 'f8')])
+TRADE_DTYPE = np.dtype([('time', 'f8'), ('price', 'f8'), ('volume', 'f8'), ('side', 'i1')])
+OHLC_DTYPE = np.dtype([('time', 'f8'), ('etime', 'f8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'),
+                       ('vwap', 'f8'), ('volume', 'f8'), ('count', 'i8')])
+CHANNEL_DTYPES = {'ticker': TICKER_DTYPE, 'trade': TRADE_DTYPE, 'ohlc': OHLC_DTYPE}
+
+
+class RingBuffer:
+    """
+    A fixed-size buffer of records backed by a NumPy structured array.
+
+    New records overwrite the oldest ones once the buffer is full. There is a single writer (the
+    WebSocket client) and the readers get views on the array, so nothing is copied on the read path.
+
+    Attributes:
+        array (np.ndarray): The underlying structured array.
+        count (int): The total number of records written since the creation of the buffer.
+    """
+    def __init__(self, capacity, dtype):
+        self.array = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, record):
+        """
+        Writes one record (a tuple in the order of the dtype fields).
+        """
+        self.array[self.count % self.capacity] = record
+        self.count += 1
+
+    def extend(self, records):
+        """
+        Writes several records at once.
+        """
+        for record in records:
+            self.append(record)
+
+    def views(self, n=None):
+        """
+        Returns the n latest records, oldest first, as two views on the array.
+
+        The records are split in two when they wrap around the end of the array, the second view is
+        empty otherwise. Use latest() when a single contiguous array is more convenient.
+
+        Parameters:
+            n (int, optional): Number of records. Default is all the records in the buffer.
+
+        Returns:
+            tuple: Two views (np.ndarray) to be read one after the other.
+        """
+        n = len(self) if n is None else min(n, len(self))
+        end = self.count % self.capacity
+        start = end - n
+        if start >= 0:
+            return self.array[start:end], self.array[:0]
+        return self.array[start:], self.array[:end]
+
+    def latest(self, n=None):
+        """
+        Returns the n latest records, oldest first. It is a view unless the records wrap around.
+        """
+        first, second = self.views(n)
+        return first if len(second) == 0 else np.concatenate([first, second])
+
+    def last(self):
+        """
+        Returns the latest record, or None if the buffer is empty.
+        """
+        if self.count == 0:
+            return None
+        return self.array[(self.count - 1) % self.capacity]
+
+
+class KrakenWSMarketData:
+    """
+    A streaming market-data client for Kraken's public WebSocket API.
+
+    It subscribes to the ticker, trade and OHLC channels of a list of pairs and keeps the latest records
+    of each (channel, pair) in a RingBuffer. The connection is opened again, and the subscriptions sent
+    again, whenever it drops.
+
+    Attributes:
+        pairs (list): The subscribed pairs, in WebSocket format (e.g. 'XBT/USD').
+        channels (list): The subscribed channels ('ticker', 'trade' and/or 'ohlc').
+        interval (int): The time interval in minutes of the OHLC channel.
+        url (str): The URL of the WebSocket API.
+        buffers (dict): The RingBuffer of each channel and pair, e.g. buffers['trade']['XBT/USD'].
+        listeners (list): Functions called with every decoded message, e.g. to maintain an order book.
+        connections (int): Number of connections opened so far.
+        errors (int): Number of errors so far: messages which could not be decoded or stored (they are dropped),
+                      and exceptions raised by the listeners (the other listeners still get the message).
+
+    Methods:
+        run():
+            Coroutine receiving the messages until stop() is called.
+
+        start() / stop():
+            Runs/stops the client in a background thread.
+    """
+    def __init__(self, pairs, channels=('ticker', 'trade', 'ohlc'), interval=1, capacity=4096, url=None,
+                 subscriptions=None):
+        """
+        Initializes the KrakenWSMarketData class.
+
+        Parameters:
+            pairs (list): The pairs to subscribe to, in WebSocket format (e.g. 'XBT/USD').
+            channels (tuple, optional): The channels to subscribe to. Default is ticker, trade and ohlc.
+            interval (int, optional): The time interval in minutes of the OHLC channel. Default is 1.
+            capacity (int, optional): Number of records kept for each channel and pair. Default is 4096.
+            url (str, optional): The URL of the WebSocket API. Default is the KRAKEN_WS_URL environment
+                                 variable, or wss://ws.kraken.com.
+            subscriptions (list, optional): Other subscriptions to send (e.g. {'name': 'book', 'depth': 10}),
+                                            their messages are only passed to the listeners.
+        """
+        self.pairs = list(pairs)
+        self.channels = list(channels)
+        self.interval = interval
+        self.url = url if url is not None else os.environ.get("KRAKEN_WS_URL", DEFAULT_WS_URL)
+        self.subscriptions = list(subscriptions or [])
+        self.buffers = {channel: {pair: RingBuffer(capacity, CHANNEL_DTYPES[channel]) for pair in self.pairs}
+                        for channel in self.channels}
+        self.listeners = []
+        self.connections = 0
+        self.errors = 0
+        self._stopping = False
+        self._thread = None
+        self._loop = None
+        self._stop_event = None
+        self._websocket = None
+
+    def _subscribe_messages(self):
+        subscriptions = []
+        for channel in self.channels:
+            subscription = {'name': channel}
+            if channel == 'ohlc':
+                subscription['interval'] = self.interval
+            subscriptions.append(subscription)
+        subscriptions += self.subscriptions
+        return [{'event': 'subscribe', 'pair': self.pairs, 'subscription': subscription}
+                for subscription in subscriptions]
+
+    def _error(self, what, raw_message, error):
+        self.errors += 1
+        print(f"WebSocket message error, {what} failed ({error!r}): {raw_message[:200]!r}")
+
+    def _receive(self, raw_message):
+        # The errors are counted and logged, the feed goes on with the next listener or message
+        try:
+            message = json.loads(raw_message)
+        except ValueError as e:
+            self._error("decoding", raw_message, e)
+            return
+        for listener in self.listeners:
+            try:
+                listener(message)
+            except Exception as e:
+                self._error(f"listener {listener!r}", raw_message, e)
+        try:
+            self._handle(message)
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e:
+            self._error("parsing", raw_message, e)
+
+    def _handle(self, message):
+
+        # Events (heartbeat, systemStatus, subscriptionStatus) are dicts, channel data are lists:
+        # [channelID, data, channelName, pair]
+        if not isinstance(message, list):
+            return
+        channel, pair, data = message[-2].split('-')[0], message[-1], message[1]
+        if channel not in self.buffers or pair not in self.buffers[channel]:
+            return
+        buffer = self.buffers[channel][pair]
+
+        if channel == 'ticker':
+            buffer.append((time.time(), float(data['b'][0]), float(data['b'][2]), float(data['a'][0]),
+                           float(data['a'][2]), float(data['c'][0]), float(data['c'][1])))
+        elif channel == 'trade':
+            buffer.extend((float(trade[2]), float(trade[0]), float(trade[1]), 1 if trade[3] == 'b' else -1)
+                          for trade in data)
+        elif channel == 'ohlc':
+            record = (float(data[0]), float(data[1]), float(data[2]), float(data[3]), float(data[4]),
+                      float(data[5]), float(data[6]), float(data[7]), int(data[8]))
+            # Updates of the candle in progress replace the previous record instead of adding a new one
+            last = buffer.last()
+            if last is not None and last['etime'] == record[1]:
+                buffer.array[(buffer.count - 1) % buffer.capacity] = record
+            else:
+                buffer.append(record)
+
+    async def run(self, max_backoff=30):
+        """
+        Connects, subscribes and receives the messages until stop() is called.
+
+        Parameters:
+            max_backoff (float, optional): Maximum delay in seconds between two reconnections. Default is 30.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        backoff = 1
+        while not self._stopping:
+            reason = "closed"
+            try:
+                async with websockets.connect(self.url) as websocket:
+                    self._websocket = websocket
+                    self.connections += 1
+                    for subscribe_message in self._subscribe_messages():
+                        await websocket.send(json.dumps(subscribe_message))
+                    async for raw_message in websocket:
+                        # The backoff only starts again from 1s once the server sends messages, a server which
+                        # accepts the connections and closes them at once is not reconnected to in a loop
+                        backoff = 1
+                        self._receive(raw_message)
+            except (websockets.exceptions.WebSocketException, OSError, asyncio.TimeoutError) as e:
+                reason = f"lost ({e!r})"
+            if self._stopping:
+                break
+            print(f"WebSocket connection {reason}, reconnecting in {backoff}s")
+            # stop() ends the wait at once
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), backoff)
+            except asyncio.TimeoutError:
+                pass
+            backoff = min(2 * backoff, max_backoff)
+
+    def start(self):
+        """
+        Runs the client in a background thread.
+        """
+        self._stopping = False
+        self._thread = threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Closes the connection and waits for the background thread to finish.
+        """
+        self._stopping = True
+        if self._loop is not None and self._stop_event is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        if self._loop is not None and self._websocket is not None:
+            asyncio.run_coroutine_threadsafe(self._websocket.close(), self._loop)
+        if self._thread is not None:
+            self._thread.join()
+
+
+if __name__ == "__main__":
+    ws_market_data = KrakenWSMarketData(["XBT/USD", "ETH/USD"])
+    ws_market_data.start()
+    time.sleep(10)
+    ws_market_data.stop()
+
+    for channel, buffers in ws_market_data.buffers.items():
+        for pair, buffer in buffers.items():
+            print(f"\n{channel} {pair}: {buffer.count} records")
+            print(buffer.latest(5))
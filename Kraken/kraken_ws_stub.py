@@ -0,0 +1,155 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import websockets
+
+
+class KrakenWSStub:
+    """
+    A local stand-in for Kraken's public WebSocket API, for tests and benchmarks.
+
+    It answers the subscriptions like Kraken does and streams synthetic ticker, trade and OHLC messages
+    (a random walk of the price) for the subscribed pairs. It can also drop the connections after a number
+    of messages, to test reconnection, or replay recorded messages instead of the synthetic ones.
+
+    Attributes:
+        host (str): The host the server listens on.
+        port (int): The port the server listens on (chosen by the system when 0).
+        url (str): The URL to give to KrakenWSMarketData, once the server is started.
+        subscriptions (list): All the subscribe messages received.
+        connections (int): Number of connections accepted so far.
+    """
+    def __init__(self, host="127.0.0.1", port=0, messages_per_second=1000, drop_after=None, replay=None):
+        """
+        Initializes the KrakenWSStub class.
+
+        Parameters:
+            host (str, optional): The host to listen on. Default is 127.0.0.1.
+            port (int, optional): The port to listen on. Default is 0, any free port.
+            messages_per_second (float, optional): Rate of the synthetic messages. Default is 1000.
+            drop_after (int, optional): Close each connection after this number of messages. Default is never.
+            replay (list, optional): Messages to send after the subscriptions instead of the synthetic ones.
+        """
+        self.host = host
+        self.port = port
+        self.messages_per_second = messages_per_second
+        self.drop_after = drop_after
+        self.replay = replay
+        self.url = None
+        self.subscriptions = []
+        self.connections = 0
+        self._channel_ids = {}
+        self._thread = None
+        self._loop = None
+        self._stopped = None
+
+    def _channel_id(self, channel, pair):
+        return self._channel_ids.setdefault((channel, pair), len(self._channel_ids) + 1)
+
+    def _synthetic_messages(self, subscriptions):
+        price = 30000.0
+        while True:
+            for channel, pair in subscriptions:
+                price *= 1 + random.gauss(0, 0.0005)
+                now = time.time()
+                channel_id = self._channel_id(channel, pair)
+                if channel == 'ticker':
+                    data = {'a': [f"{price + 0.1:.1f}", 1, "1.000"], 'b': [f"{price - 0.1:.1f}", 1, "1.000"],
+                            'c': [f"{price:.1f}", "0.01000000"]}
+                elif channel == 'trade':
+                    data = [[f"{price:.1f}", f"{random.random():.8f}", f"{now:.6f}", random.choice('bs'), 'l', '']]
+                else:
+                    interval = int(channel.split('-')[1]) * 60
+                    etime = (now // interval + 1) * interval
+                    data = [f"{now:.6f}", f"{etime:.6f}", f"{price:.1f}", f"{price:.1f}", f"{price:.1f}",
+                            f"{price:.1f}", f"{price:.1f}", "1.00000000", 1]
+                yield [channel_id, data, channel, pair]
+
+    async def _handler(self, websocket, *args):
+        self.connections += 1
+        await websocket.send(json.dumps({'event': 'systemStatus', 'status': 'online', 'version': 'stub'}))
+        subscriptions = []
+
+        async def receive():
+            async for raw_message in websocket:
+                message = json.loads(raw_message)
+                if message.get('event') != 'subscribe':
+                    continue
+                self.subscriptions.append(message)
+                name = message['subscription']['name']
+                channel = f"{name}-{message['subscription'].get('interval', 1)}" if name == 'ohlc' else name
+                for pair in message['pair']:
+                    subscriptions.append((channel, pair))
+                    await websocket.send(json.dumps({
+                        'channelID': self._channel_id(channel, pair), 'channelName': channel, 'event':
+                        'subscriptionStatus', 'pair': pair, 'status': 'subscribed', 'subscription': message['subscription']
+                    }))
+
+        receiver = asyncio.ensure_future(receive())
+        try:
+            # Wait for the first subscription before streaming
+            while not subscriptions:
+                await asyncio.sleep(0.01)
+            messages = iter(self.replay) if self.replay is not None else self._synthetic_messages(subscriptions)
+            for sent, message in enumerate(messages):
+                if self.drop_after is not None and sent >= self.drop_after:
+                    break
+                await websocket.send(json.dumps(message))
+                if self.messages_per_second:
+                    await asyncio.sleep(1 / self.messages_per_second)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            receiver.cancel()
+            await websocket.close()
+
+    async def serve(self, ready=None):
+        """
+        Coroutine running the server until stop() is called.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        async with websockets.serve(self._handler, self.host, self.port) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            self.url = f"ws://{self.host}:{self.port}"
+            if ready is not None:
+                ready.set()
+            await self._stopped.wait()
+
+    def start(self):
+        """
+        Runs the server in a background thread and returns its URL.
+        """
+        ready = threading.Event()
+        self._thread = threading.Thread(target=asyncio.run, args=(self.serve(ready),), daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.url
+
+    def stop(self):
+        """
+        Stops the server and waits for the background thread to finish.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        if self._thread is not None:
+            self._thread.join()
+
+
+if __name__ == "__main__":
+    from kraken_ws_market_data import KrakenWSMarketData
+
+    # Stream from the stub, dropping the connection every 500 messages to exercise the reconnection
+    stub = KrakenWSStub(drop_after=500)
+    url = stub.start()
+    ws_market_data = KrakenWSMarketData(["XBT/USD"], url=url)
+    ws_market_data.start()
+    time.sleep(5)
+    ws_market_data.stop()
+    stub.stop()
+
+    print(f"Connections: {ws_market_data.connections}, errors: {ws_market_data.errors}")
+    for channel, buffers in ws_market_data.buffers.items():
+        print(f"{channel}: {buffers['XBT/USD'].count} records, last {buffers['XBT/USD'].last()}")
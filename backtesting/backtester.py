@@ -0,0 +1,370 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+# Columns naming the symbol and the date in the frames of KrakenAPIMarketData.get_historical_data
+# and of the crypto_daily_rates_hist table
+SYMBOL_COLUMNS = ("pair", "ticker")
+TIME_COLUMNS = ("date", "timestamp")
+
+
+def price_matrix(df, price_col="close"):
+    """
+    Pivots a long OHLC frame into a matrix of prices, one column per symbol and one row per date.
+
+    Parameters:
+        df (pd.DataFrame): The candles of one or several symbols, from KrakenAPIMarketData.get_historical_data
+                           (pair, timestamp) or from the crypto_daily_rates_hist table (ticker, date).
+        price_col (str, optional): The price to trade at. Default is 'close'.
+
+    Returns:
+        pd.DataFrame: The prices, indexed by date, with NaN where a symbol has no candle.
+    """
+    symbol_col = next((column for column in SYMBOL_COLUMNS if column in df.columns), None)
+    time_col = next((column for column in TIME_COLUMNS if column in df.columns), None)
+    if time_col == "timestamp":
+        times = pd.to_datetime(df[time_col].to_numpy(), unit='s')
+    elif time_col is not None:
+        times = pd.to_datetime(df[time_col].to_numpy())
+    else:
+        times = df.index
+    if symbol_col is None:
+        return pd.DataFrame({price_col: df[price_col].to_numpy(dtype='float64')}, index=times).sort_index()
+
+    long = pd.DataFrame({"time": times, "symbol": df[symbol_col].to_numpy(),
+                         "price": df[price_col].to_numpy(dtype='float64')})
+    return long.pivot_table(index="time", columns="symbol", values="price", aggfunc="last",
+                            observed=True).sort_index()
+
+
+def threshold_signal(scores, long_threshold, short_threshold=None):
+    """
+    Turns model scores (e.g. predicted probabilities of a rise) into positions.
+
+    Parameters:
+        scores (array-like): The scores, one column per symbol.
+        long_threshold (float): Scores at or above it give a long position (1).
+        short_threshold (float, optional): Scores at or below it give a short position (-1). Default is no shorts.
+
+    Returns:
+        np.ndarray: The signal, 1, 0 or -1.
+    """
+    scores = np.asarray(scores, dtype='float64')
+    signal = (scores >= long_threshold).astype('float64')
+    if short_threshold is not None:
+        signal -= scores <= short_threshold
+    return signal
+
+
+def scores_signal(prices, scores, long_threshold, short_threshold=None):
+    """
+    threshold_signal in the form of the signal functions of parameter_sweep, which receive the prices first.
+    """
+    return threshold_signal(scores, long_threshold, short_threshold)
+
+
+def moving_average_crossover_signal(prices, fast, slow):
+    """
+    Long when the fast moving average of the price is above the slow one, flat otherwise.
+
+    Parameters:
+        prices (np.ndarray): The prices, one column per symbol.
+        fast (int): The window of the fast moving average.
+        slow (int): The window of the slow moving average.
+
+    Returns:
+        np.ndarray: The signal, 1 or 0, and 0 while a window of either average has a missing price.
+    """
+    prices = np.asarray(prices, dtype='float64')
+    if prices.ndim == 1:
+        prices = prices[:, None]
+    # The missing prices add nothing to the sums, and are counted to leave their windows undefined
+    valid = ~np.isnan(prices)
+    zeros = np.zeros((1, prices.shape[1]))
+    cumulated = np.vstack([zeros, np.cumsum(np.where(valid, prices, 0.0), axis=0)])
+    counted = np.vstack([zeros, np.cumsum(valid, axis=0)])
+
+    def moving_average(window):
+        # A window with a missing price has no average, as with pandas' rolling(window).mean()
+        average = np.full(prices.shape, np.nan)
+        complete = counted[window:] - counted[:-window] == window
+        average[window - 1:] = np.where(complete, (cumulated[window:] - cumulated[:-window]) / window, np.nan)
+        return average
+
+    with np.errstate(invalid='ignore'):
+        return (moving_average(fast) > moving_average(slow)).astype('float64')
+
+
+def run_backtest(prices, signal, fee=0.0026, slippage=0.0005, lag=1, initial_capital=1.0):
+    """
+    Computes the positions, costs and equity curves of a signal, vectorized over dates and symbols.
+
+    The signal is the target position of each symbol as a fraction of its capital (1 long, 0 flat, -1 short).
+    It is applied lag bars later, so that a signal computed on a close only trades on the next one. Each change
+    of position pays the fee and the slippage on the traded fraction.
+
+    Parameters:
+        prices (array-like): The prices, one column per symbol (or a single column).
+        signal (array-like): The target positions, with the same shape as prices.
+        fee (float, optional): The fee rate on the traded value. Default is 0.0026 (Kraken's taker fee).
+        slippage (float, optional): The slippage rate on the traded value. Default is 0.0005.
+        lag (int, optional): Number of bars between a signal and its trade. Default is 1.
+        initial_capital (float, optional): The capital of each symbol. Default is 1.
+
+    Returns:
+        dict: Arrays with the shape of prices: 'positions', 'returns' (of the prices), 'costs', 'net_returns'
+              and 'equity', and the 'portfolio_equity' of an equal-weight portfolio of the symbols, rebalanced
+              on each bar.
+    """
+    prices = np.asarray(prices, dtype='float64')
+    signal = np.asarray(signal, dtype='float64')
+    if prices.ndim == 1:
+        prices, signal = prices[:, None], signal.reshape(-1, 1)
+
+    returns = np.zeros_like(prices)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns[1:] = prices[1:] / prices[:-1] - 1
+    # No return on the dates a symbol has no price
+    returns = np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+    positions = np.zeros_like(signal)
+    positions[lag:] = np.nan_to_num(signal[:len(signal) - lag] if lag else signal)
+    turnover = np.abs(np.diff(positions, axis=0, prepend=0.0))
+    costs = turnover * (fee + slippage)
+    net_returns = positions * returns - costs
+    equity = initial_capital * np.cumprod(1 + net_returns, axis=0)
+    portfolio_equity = initial_capital * np.cumprod(1 + net_returns.mean(axis=1))
+    return {
+        "positions": positions,
+        "returns": returns,
+        "costs": costs,
+        "net_returns": net_returns,
+        "equity": equity,
+        "portfolio_equity": portfolio_equity,
+    }
+
+
+def performance_stats(result, periods_per_year=365):
+    """
+    Summarizes the equal-weight portfolio of a backtest.
+
+    Parameters:
+        result (dict): The result of run_backtest.
+        periods_per_year (int, optional): Number of bars per year, 365 for daily crypto candles.
+
+    Returns:
+        dict: The total return, annualized return and volatility, Sharpe ratio, maximum drawdown,
+              number of trades and total costs.
+    """
+    equity = result["portfolio_equity"]
+    returns = result["net_returns"].mean(axis=1)
+    years = len(equity) / periods_per_year
+    total_return = np.prod(1 + returns) - 1
+    volatility = returns.std() * np.sqrt(periods_per_year)
+    drawdown = equity / np.maximum.accumulate(equity) - 1
+    return {
+        "total_return": total_return,
+        "annual_return": (1 + total_return) ** (1 / years) - 1 if years > 0 else np.nan,
+        "annual_volatility": volatility,
+        "sharpe": returns.mean() * periods_per_year / volatility if volatility > 0 else np.nan,
+        "max_drawdown": drawdown.min(),
+        "trades": int(np.count_nonzero(np.diff(result["positions"], axis=0, prepend=0.0))),
+        "costs": result["costs"].sum(),
+    }
+
+
+class Backtest:
+    """
+    A backtest of a signal on the OHLC candles of one or several symbols.
+
+    Attributes:
+        prices (pd.DataFrame): The prices, indexed by date, one column per symbol.
+        result (dict): The arrays of run_backtest once run() was called.
+
+    Methods:
+        run(signal):
+            Backtests a signal aligned with the prices.
+
+        equity() / positions():
+            Return the equity curves or the positions as DataFrames.
+
+        stats():
+            Returns the performance of the equal-weight portfolio.
+    """
+    def __init__(self, df, price_col="close", fee=0.0026, slippage=0.0005, lag=1, periods_per_year=365):
+        """
+        Initializes the Backtest class.
+
+        Parameters:
+            df (pd.DataFrame): The candles, from KrakenAPIMarketData.get_historical_data or crypto_daily_rates_hist,
+                               or a matrix of prices indexed by date.
+            price_col (str, optional): The price to trade at. Default is 'close'.
+            fee (float, optional): The fee rate on the traded value. Default is 0.0026.
+            slippage (float, optional): The slippage rate on the traded value. Default is 0.0005.
+            lag (int, optional): Number of bars between a signal and its trade. Default is 1.
+            periods_per_year (int, optional): Number of bars per year. Default is 365.
+        """
+        self.prices = price_matrix(df, price_col) if price_col in df.columns else df.astype('float64')
+        self.fee = fee
+        self.slippage = slippage
+        self.lag = lag
+        self.periods_per_year = periods_per_year
+        self.result = None
+
+    def run(self, signal):
+        """
+        Backtests a signal.
+
+        Parameters:
+            signal (pd.DataFrame, pd.Series or np.ndarray): The target positions. A DataFrame is aligned on the
+                dates and symbols of the prices. A Series indexed by date is aligned on the dates and applied to
+                every symbol, a Series indexed by (symbol, date) or (date, symbol) is aligned on both.
+
+        Returns:
+            Backtest: self, to chain with stats() or equity().
+        """
+        if isinstance(signal, pd.Series):
+            signal = self._series_signal(signal)
+        elif isinstance(signal, pd.DataFrame):
+            if len(self.prices.columns) > 1:
+                signal = signal.reindex(index=self.prices.index, columns=self.prices.columns)
+            else:
+                signal = signal.reindex(self.prices.index)
+            signal = signal.to_numpy()
+        self.result = run_backtest(self.prices.to_numpy(), signal, self.fee, self.slippage, self.lag)
+        return self
+
+    def _series_signal(self, signal):
+        # The signal of a Series as a matrix with the shape of the prices
+        n_symbols = len(self.prices.columns)
+        if signal.index.nlevels == 1:
+            signal = signal.reindex(self.prices.index).to_numpy(dtype='float64')
+            return np.repeat(signal[:, None], n_symbols, axis=1)
+        if signal.index.nlevels == 2:
+            # The symbol level is the one holding the columns of the prices
+            symbols = set(self.prices.columns)
+            levels = [level for level in range(2) if symbols.intersection(signal.index.get_level_values(level))]
+            if len(levels) == 1:
+                matrix = signal.unstack(level=levels[0])
+                return matrix.reindex(index=self.prices.index, columns=self.prices.columns).to_numpy(dtype='float64')
+        raise ValueError("A signal Series must be indexed by date, or by (symbol, date) with the symbols of the "
+                         f"prices {list(self.prices.columns)}")
+
+    def equity(self):
+        """
+        Returns the equity curve of each symbol and of the equal-weight portfolio.
+        """
+        df = pd.DataFrame(self.result["equity"], index=self.prices.index, columns=self.prices.columns)
+        df["portfolio"] = self.result["portfolio_equity"]
+        return df
+
+    def positions(self):
+        """
+        Returns the position held on each date.
+        """
+        return pd.DataFrame(self.result["positions"], index=self.prices.index, columns=self.prices.columns)
+
+    def stats(self):
+        return performance_stats(self.result, self.periods_per_year)
+
+
+# Arrays shared with the worker processes of a sweep, attached once per process
+_shared_arrays = {}
+_shared_memories = []
+
+
+def _attach_shared_arrays(specs):
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _shared_memories.append(shm)
+        _shared_arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _evaluate(signal_function, params, costs, periods_per_year):
+    arrays = dict(_shared_arrays)
+    prices = arrays.pop("prices")
+    signal = signal_function(prices, **arrays, **params)
+    result = run_backtest(prices, signal, **costs)
+    return dict(params, **performance_stats(result, periods_per_year))
+
+
+def parameter_sweep(prices, signal_function, param_grid, inputs=None, fee=0.0026, slippage=0.0005, lag=1,
+                    periods_per_year=365, processes=None, chunksize=None):
+    """
+    Backtests every combination of parameters of a signal function across a pool of processes.
+
+    The prices and inputs are copied once into shared memory, and each worker process maps them
+    instead of receiving a copy with every task: only the parameters and the statistics are sent.
+
+    Parameters:
+        prices (array-like): The prices, one column per symbol (e.g. Backtest.prices or price_matrix()).
+        signal_function (function): A module-level function called as signal_function(prices, **inputs, **params)
+                                    and returning the signal, e.g. moving_average_crossover_signal.
+        param_grid (dict or list): The values of each parameter, e.g. {"fast": [5, 10], "slow": [20, 50]},
+                                   or a list of parameter dicts.
+        inputs (dict, optional): Other arrays passed to the signal function, e.g. {"scores": scores}.
+        fee (float, optional): The fee rate on the traded value. Default is 0.0026.
+        slippage (float, optional): The slippage rate on the traded value. Default is 0.0005.
+        lag (int, optional): Number of bars between a signal and its trade. Default is 1.
+        periods_per_year (int, optional): Number of bars per year. Default is 365.
+        processes (int, optional): Number of worker processes. Default is the number of CPUs.
+        chunksize (int, optional): Number of combinations sent to a worker at once. Default is computed.
+
+    Returns:
+        pd.DataFrame: One row per combination, with the parameters and the statistics of performance_stats.
+    """
+    if isinstance(param_grid, dict):
+        names = list(param_grid)
+        combinations = [dict(zip(names, values)) for values in itertools.product(*param_grid.values())]
+    else:
+        combinations = list(param_grid)
+    processes = processes or os.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, len(combinations) // (4 * processes))
+
+    arrays = {"prices": np.asarray(prices, dtype='float64')}
+    arrays.update({name: np.asarray(value) for name, value in (inputs or {}).items()})
+    memories = []
+    specs = {}
+    try:
+        for name, array in arrays.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            memories.append(shm)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            specs[name] = (shm.name, array.shape, array.dtype.str)
+
+        costs = {"fee": fee, "slippage": slippage, "lag": lag}
+        with ProcessPoolExecutor(max_workers=processes, initializer=_attach_shared_arrays,
+                                 initargs=(specs,)) as executor:
+            rows = list(executor.map(_evaluate, itertools.repeat(signal_function), combinations,
+                                     itertools.repeat(costs), itertools.repeat(periods_per_year),
+                                     chunksize=chunksize))
+    finally:
+        for shm in memories:
+            shm.close()
+            shm.unlink()
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import time
+
+    # Sweep a moving average crossover over 20 years of synthetic daily prices of 50 symbols
+    rng = np.random.default_rng(0)
+    n_days, n_symbols = 7300, 50
+    prices = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.03, (n_days, n_symbols)), axis=0))
+    grid = {"fast": list(range(5, 50, 5)), "slow": list(range(50, 250, 10))}
+
+    start = time.perf_counter()
+    result = run_backtest(prices, moving_average_crossover_signal(prices, 20, 100))
+    print(f"One backtest of {n_days} days x {n_symbols} symbols: {1000 * (time.perf_counter() - start):.1f} ms")
+    print(performance_stats(result))
+
+    for processes in (1, os.cpu_count()):
+        start = time.perf_counter()
+        df = parameter_sweep(prices, moving_average_crossover_signal, grid, processes=processes)
+        print(f"Sweep of {len(df)} combinations with {processes} processes: {time.perf_counter() - start:.2f}s")
+    print(df.sort_values("sharpe", ascending=False).head())
@@ -1,37 +1,121 @@
 import pandas as pd
-from yahoo_fin.stock_info import get_data   
+import numpy as np
+from yahoo_fin.stock_info import get_data
 from yahooquery import Screener
 import psycopg2
-import io
-
-# Finding first 250 symbols in a list
-s = Screener()
-data = s.get_screeners('all_cryptocurrencies_us', count=5)
-
-# retrieving a list of symbols
-dicts = data['all_cryptocurrencies_us']['quotes']
-symbols = [d['symbol'] for d in dicts]
+import os
+import queue
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pg_copy import copy_dataframe
+import db_access
 
 # initializing Parameters
 start_date = "05/01/2023"    # the date we want to start from
 end_date = None             # the end date, None = today
 index_as_date = False        # Set the date as index of the df
 interval = "1d"             # retrieving the data on a daily basis
+symbols_count = 5           # number of symbols retrieved from the screener
+max_workers = 8             # number of tickers downloaded at the same time
+max_retries = 3             # number of attempts for each ticker before it is reported as failed
+retry_backoff = 2.0         # seconds to wait before the second attempt, doubled for each following attempt
+incremental = True          # only fetch the rows newer than the stored ones, instead of reloading the tickers
+copy_format = "binary"      # format of the COPY uploads, "binary" or "csv"
+copy_chunk_rows = 50000     # rows encoded at a time by the uploads, bounds their memory
+
+# columns kept from the quote source
+quote_columns = ['date', 'open', 'high', 'low', 'close', 'adjclose', 'volume', 'ticker']
+
+# the single long-format table of all the tickers, partitioned by year (sql/create_crypto_daily_rates_hist)
+table_name = "crypto_daily_rates_hist"
+table_columns = ['date', 'open', 'high', 'low', 'close', 'adjclose', 'volume', 'ticker', 'currency_id']
+schema_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql", "create_crypto_daily_rates_hist")
+
+
+# 0- QUOTE SOURCES: where the daily rates come from
+class YahooQuoteSource:
+    """
+    The daily rates of Yahoo Finance, through yahooquery (list of symbols) and yahoo_fin (history).
+    """
+    def symbols(self, count):
+        # Finding the first symbols in the list of all the cryptocurrencies
+        s = Screener()
+        data = s.get_screeners('all_cryptocurrencies_us', count=count)
+        dicts = data['all_cryptocurrencies_us']['quotes']
+        return [d['symbol'] for d in dicts]
+
+    def get_data(self, symbol, start_date, end_date, index_as_date, interval):
+        # the get_data function is from yahoo_fin.stock_info
+        return get_data(symbol, start_date, end_date, index_as_date, interval)
+
+
+class StubQuoteSource:
+    """
+    A local quote source to run the collector offline.
+
+    It reads the csv files saved by ticker_data (data_dir/<symbol_clean>.csv) when a directory is given,
+    and generates a random walk otherwise. The symbols in fail_symbols always fail, and the ones in
+    flaky_symbols fail on their first attempt only, to exercise the retries and the failure report.
+    """
+    def __init__(self, symbols=("BTC-USD", "ETH-USD", "USDT-USD", "BNB-USD", "XRP-USD"), data_dir=None,
+                 fail_symbols=(), flaky_symbols=(), delay=0.0):
+        self._symbols = list(symbols)
+        self.data_dir = data_dir
+        self.fail_symbols = set(fail_symbols)
+        self.flaky_symbols = set(flaky_symbols)
+        self.delay = delay
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def symbols(self, count):
+        return self._symbols[:count]
+
+    def get_data(self, symbol, start_date, end_date, index_as_date, interval):
+        with self._lock:
+            self.calls[symbol] = self.calls.get(symbol, 0) + 1
+            attempt = self.calls[symbol]
+        time.sleep(self.delay)
+        if symbol in self.fail_symbols or (symbol in self.flaky_symbols and attempt == 1):
+            raise ConnectionError(f"stub failure for {symbol}")
+
+        if self.data_dir is not None:
+            path = os.path.join(self.data_dir, f"{clean_name(symbol)}.csv")
+            df = pd.read_csv(path, parse_dates=['date'])
+            df = df[df['date'] >= pd.to_datetime(start_date)]
+            if end_date is not None:
+                df = df[df['date'] <= pd.to_datetime(end_date)]
+            return df
+
+        dates = pd.date_range(start_date, end_date or pd.Timestamp.today().normalize(), freq="D")
+        rng = np.random.default_rng(sum(map(ord, symbol)))
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.03, len(dates))))
+        return pd.DataFrame({'date': dates, 'open': close * (1 + rng.normal(0, 0.01, len(dates))),
+                             'high': close * 1.02, 'low': close * 0.98, 'close': close, 'adjclose': close,
+                             'volume': rng.integers(10 ** 6, 10 ** 9, len(dates)), 'ticker': symbol})
+
+
+def clean_name(symbol):
+    # cleaning the symbol name for sql use
+    return symbol.lower().replace(" ","").replace("-","_")
+
 
 # 1- FUNCTION to retrieve the data of a single ticker (AND OPTIONAL) saving the csv files locally.
-def ticker_data(symbol):
-    # the get_data function is from yahoo_fin.stock_info 
-    response = get_data(symbol, start_date, end_date, index_as_date, interval)
+def ticker_data(symbol, quote_source=None, start=None):
+    if quote_source is None:
+        quote_source = YahooQuoteSource()
+    # start is the first date to fetch for this ticker, start_date by default
+    response = quote_source.get_data(symbol, start or start_date, end_date, index_as_date, interval)
     # putting the response in a DataFrame
     df = pd.DataFrame(response)
 
-    # selecting all the columns 
-    df = df[['date', 'open', 'high', 'low', 'close', 'adjclose', 'volume', 'ticker']]
+    # selecting all the columns
+    df = df[quote_columns]
     # modify the date coluumn from object to date
     df['date'] = pd.to_datetime(df['date'])
 
     #cleaning the symobol name and columns names for sql use
-    symbol_clean = symbol.lower().replace(" ","").replace("-","_")
+    symbol_clean = clean_name(symbol)
     df.columns = [x.lower().replace(" ","").replace("-","_") for x in df.columns]
 
     # saving locally
@@ -42,78 +126,167 @@ def ticker_data(symbol):
     # Returning the DataFrame and symol cleaned
     return df, symbol_clean
 
-# 2- Changing the types of columns from dtypes(python) to SQL types
-
-# 2.1 mapping
-map_dict = {"datetime64[ns]":"DATE",
-          "float64": "NUMERIC",
-          "object":"VARCHAR",
-          "int64": "BIGINT"}
-
-
-# 2.2 FUNCTION that gives out (columns corresponding to its type ',') in SQL data types:
-# EXAMPLE: date DATE, 
-#          open NUMERIC, 
-#          name VARCHAR,
-
-def to_sql(df, map_dict):
-    cols_map= zip(df.columns, df.dtypes.replace(map_dict))
-    sql_cols= ", ".join("{} {}".format(n, d) for (n, d) in cols_map)
-    return sql_cols
-
-# 3- Function using query script to create the table on Postgessql
-def table_create(symbol_clean, sql_cols):
-    cursor.execute(f"DROP TABLE IF EXISTS {symbol_clean};")
-    query = f""" 
-            CREATE TABLE {symbol_clean} (
-            {sql_cols}
-            )
-            """
-    cursor.execute(query)
-    print("table created")
-    
-# 4- Function to convert the DF to csv on the RAM and copy it to the corresponding table
-def upload(df, symbol_clean):
-    schema_name = 'public'
-    csv_file = io.StringIO()
-    df.to_csv(csv_file, header = df.columns, index = False, encoding = 'utf-8')
-    csv_file.seek(0)
-    sql_statement = f"""
-        COPY {schema_name}.{symbol_clean} FROM STDIN WITH 
-            CSV
-            HEADER
-            DELIMITER AS ','
-        """
-    cursor.copy_expert(sql=sql_statement, file=csv_file)
-    csv_file.close()
-
-##################  CONNECTION TO AWS_DB   #################
-db_endpoint = "postgres-1.clmlqirmvrik.eu-central-1.rds.amazonaws.com"
-db_port = 5432
-db_name = "OPA_project"
-db_user = "postgres"
-db_password = "datascientest"
-
-connection = psycopg2.connect(
-    host=db_endpoint,
-    port=db_port,
-    dbname=db_name,
-    user=db_user,
-    password=db_password
-)
-cursor = connection.cursor()
-
-# 5- IF connection is TRUE perform the following
-if connection:
-
-    #Iterating over the list of symbols
-    for symbol in symbols:
-        df, symbol_clean = ticker_data(symbol)         # Get the DataFrame, symbol clean from ticker_data() function
-        sql_cols = to_sql(df, map_dict)                # Use sql_col function to to map the the SQL type of each column
-        table_create(symbol_clean, sql_cols)           # Create the table by SQL query ON AWS-Postgressql
-        upload(df,symbol_clean)                        # Upload the data to the created table ON AWS
+
+# 1.1 FUNCTION retrying a ticker, so that one bad symbol does not abort the run
+def ticker_data_with_retries(symbol, quote_source, retries=max_retries, backoff=retry_backoff, start=None):
+    for attempt in range(1, retries + 1):
+        try:
+            df, symbol_clean = ticker_data(symbol, quote_source, start)
+            return {"symbol": symbol, "df": df, "symbol_clean": symbol_clean, "attempts": attempt, "error": None}
+        except Exception as error:
+            last_error = error
+            if attempt < retries:
+                time.sleep(backoff * 2 ** (attempt - 1))
+    return {"symbol": symbol, "df": None, "symbol_clean": None, "attempts": retries, "error": repr(last_error)}
+
+# 2- FUNCTION giving the rows of a ticker the layout of the table shared by all the tickers
+def to_long_format(df, symbol):
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date']).dt.normalize()
+    for column in ['open', 'high', 'low', 'close', 'adjclose']:
+        df[column] = df[column].astype('float64')
+    df['volume'] = df['volume'].round().astype('Int64')
+    # e.g. BTC-USD is stored as the ticker btc-usd of the currency btc
+    df['ticker'] = symbol.lower()
+    df['currency_id'] = symbol.lower().split('-')[0]
+    return df[table_columns]
+
+# 3- Function creating the table and its yearly partitions if they do not exist yet
+def schema_ensure(cursor):
+    with open(schema_file) as file:
+        cursor.execute(file.read())
+
+# 3.1 Function creating the partitions of the years covered by the DF, before its rows are inserted
+def partitions_ensure(cursor, df):
+    years = df['date'].dt.year
+    cursor.execute(f"SELECT {table_name}_add_partitions(%s, %s)", (int(years.min()), int(years.max())))
+
+# 3.2 Function reading the latest stored date of each ticker, None for the tickers not stored yet
+def latest_dates(cursor, tickers):
+    # one index lookup per ticker on the primary key (ticker, date)
+    cursor.execute(f"SELECT ticker, max(date) FROM {table_name} WHERE ticker = ANY(%s) GROUP BY ticker",
+                   (list(tickers),))
+    stored = dict(cursor.fetchall())
+    return {ticker: stored.get(ticker) for ticker in tickers}
+
+# 4- Function streaming the DF to the corresponding table with COPY, chunk by chunk (see pg_copy.py)
+def upload(cursor, df, table=table_name, schema_name='public'):
+    copy_dataframe(cursor, df, table, schema_name, format=copy_format, chunk_rows=copy_chunk_rows)
+
+# 4.1 Function merging the DF into the table: COPY into a staging table, then INSERT ... ON CONFLICT
+def upsert(cursor, df):
+    staging = f"staging_{table_name}"
+    cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+    # temporary tables live in their own schema
+    upload(cursor, df, staging, schema_name='pg_temp')
+    columns = ", ".join(df.columns)
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in df.columns
+                        if column not in ("ticker", "date"))
+    cursor.execute(f"""
+        INSERT INTO {table_name} ({columns})
+        SELECT {columns} FROM {staging}
+        ON CONFLICT (ticker, date) DO UPDATE SET {updates}
+        """)
+    cursor.execute(f"DROP TABLE {staging}")
+
+# 4.2 Function replacing all the stored rows of the ticker by the DF
+def replace(cursor, df):
+    cursor.execute(f"DELETE FROM {table_name} WHERE ticker = %s", (df['ticker'].iloc[0],))
+    upload(cursor, df)
+
+
+# 5- FUNCTION downloading the tickers concurrently while a single writer loads them in the database
+def collect(symbols, connection, quote_source=None, workers=max_workers, retries=max_retries,
+            incremental=incremental):
+    """
+    Downloads the tickers with a bounded pool of threads and writes them with a single cursor.
+
+    The downloads are handed to the writer (the calling thread) through a bounded queue, so at most a few
+    DataFrames wait in memory while the database is busy. A ticker that still fails after its retries, or
+    that cannot be written, is reported and skipped; the other ones are committed together at the end.
+
+    All the tickers are written to the table crypto_daily_rates_hist, created with its partitions if needed.
+    In incremental mode each ticker is fetched from its latest stored date (which is fetched again, since
+    the candle of the current day changes until it closes) and merged with an upsert on (ticker, date).
+    Otherwise the stored rows of each ticker are deleted and fully reloaded.
+
+    Returns:
+        dict: The number of rows loaded for each symbol ("loaded") and the error of each failed symbol ("failed").
+    """
+    if quote_source is None:
+        quote_source = YahooQuoteSource()
+    results = queue.Queue(maxsize=2 * workers)
+    report = {"loaded": {}, "failed": {}}
+    cursor = connection.cursor()
+    schema_ensure(cursor)
+    starts = {}
+    if incremental:
+        stored = latest_dates(cursor, [symbol.lower() for symbol in symbols])
+        starts = {symbol: stored[symbol.lower()] for symbol in symbols}
+
+    def download(symbol):
+        start = starts.get(symbol)
+        results.put(ticker_data_with_retries(symbol, quote_source, retries,
+                                             start=None if start is None else start.strftime("%m/%d/%Y")))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(download, symbol) for symbol in symbols]
+        try:
+            # The writer stage: the only thread using the connection
+            for _ in symbols:
+                result = results.get()
+                if result["error"] is not None:
+                    print(f"{result['symbol']} failed after {result['attempts']} attempts: {result['error']}")
+                    report["failed"][result["symbol"]] = result["error"]
+                    continue
+                df = to_long_format(result["df"], result["symbol"])
+                if df.empty:
+                    report["loaded"][result["symbol"]] = 0
+                    continue
+                cursor.execute("SAVEPOINT ticker")
+                try:
+                    partitions_ensure(cursor, df)      # Create the partitions of the new years ON AWS-Postgressql
+                    if incremental:
+                        upsert(cursor, df)             # Merge the new rows into the table ON AWS
+                    else:
+                        replace(cursor, df)            # Reload all the rows of the ticker ON AWS
+                except psycopg2.Error as error:
+                    cursor.execute("ROLLBACK TO SAVEPOINT ticker")
+                    print(f"{result['symbol']} could not be written: {error}")
+                    report["failed"][result["symbol"]] = repr(error)
+                    continue
+                cursor.execute("RELEASE SAVEPOINT ticker")
+                report["loaded"][result["symbol"]] = len(df)
+        finally:
+            # If the writer stopped early, unblock the downloads waiting for room in the queue
+            for future in futures:
+                future.cancel()
+            while not all(future.done() for future in futures):
+                try:
+                    results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
     connection.commit()
     cursor.close()
-    connection.close()
-else:
-    print("Connection Error, Please Fix!")
+    print(f"{len(report['loaded'])} tickers loaded, {len(report['failed'])} failed")
+    for symbol, error in report["failed"].items():
+        print(f"  {symbol}: {error}")
+    return report
+
+
+def main(quote_source=None):
+    if quote_source is None:
+        quote_source = YahooQuoteSource()
+
+    # retrieving a list of symbols
+    symbols = quote_source.symbols(symbols_count)
+
+    # the connection settings come from the environment (OPA_DB_* or PG* variables), see db_access.py
+    with db_access.connection() as connection:
+        return collect(symbols, connection, quote_source)
+
+
+if __name__ == "__main__":
+    # Set CRYPTO_QUOTE_SOURCE=stub to run offline on generated quotes
+    main(StubQuoteSource() if os.environ.get("CRYPTO_QUOTE_SOURCE") == "stub" else None)
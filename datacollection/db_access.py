@@ -0,0 +1,308 @@
+"""
+Shared access to the OPA_project database: connection pool, configuration and streaming reads.
+
+The connection settings come from the environment: OPA_DB_HOST, OPA_DB_PORT, OPA_DB_NAME, OPA_DB_USER and
+OPA_DB_PASSWORD, or else the usual PGHOST, PGPORT, PGDATABASE, PGUSER and PGPASSWORD. The password is
+never written in the code, without any variable libpq looks it up in ~/.pgpass.
+
+The reads go through named (server-side) cursors: the server keeps the result and sends it chunk_rows rows
+at a time, so a large query never sits in the client as one list of tuples. Each chunk is converted column
+by column into typed arrays, and is either yielded as a DataFrame (stream_query, iter_rates) or copied into
+typed arrays grown chunk by chunk for the whole result (read_frame, read_rates).
+
+Example:
+    from db_access import read_rates
+    df_btc = read_rates(tickers=["btc-usd"], start="2022-01-01", columns=["date", "close", "volume"])
+"""
+import itertools
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+
+# Settings used when neither the OPA_DB_* nor the PG* variable is set (the password has no default)
+DEFAULT_PARAMS = {
+    "host": "postgres-1.clmlqirmvrik.eu-central-1.rds.amazonaws.com",
+    "port": "5432",
+    "dbname": "OPA_project",
+    "user": "postgres",
+}
+# Environment variables of each connection setting, by priority
+ENV_PARAMS = {
+    "host": ("OPA_DB_HOST", "PGHOST"),
+    "port": ("OPA_DB_PORT", "PGPORT"),
+    "dbname": ("OPA_DB_NAME", "PGDATABASE"),
+    "user": ("OPA_DB_USER", "PGUSER"),
+    "password": ("OPA_DB_PASSWORD", "PGPASSWORD"),
+}
+
+# Rows sent by the server at a time
+DEFAULT_CHUNK_ROWS = 50000
+
+RATES_TABLE = "crypto_daily_rates_hist"
+RATES_COLUMNS = ["date", "open", "high", "low", "close", "adjclose", "volume", "ticker", "currency_id"]
+
+# How the values of each PostgreSQL type (by oid) are converted, the other types are kept as objects
+_OID_KINDS = {
+    16: "bool",
+    20: "int", 21: "int", 23: "int",
+    700: "float", 701: "float", 1700: "float",
+    1082: "date",
+    1114: "timestamp", 1184: "timestamptz",
+    19: "text", 25: "text", 1042: "text", 1043: "text",
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+_cursor_ids = itertools.count()
+
+
+def db_params():
+    """
+    Reads the connection settings from the environment.
+
+    Returns:
+        dict: The keyword arguments of psycopg2.connect.
+    """
+    params = {}
+    for key, names in ENV_PARAMS.items():
+        value = next((os.environ[name] for name in names if os.environ.get(name)), DEFAULT_PARAMS.get(key))
+        if value is not None:
+            params[key] = value
+    return params
+
+
+def get_pool():
+    """
+    Returns the connection pool of the process, created on first use.
+
+    Its size is set by OPA_DB_POOL_MIN (1 by default) and OPA_DB_POOL_MAX (8 by default).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ThreadedConnectionPool(int(os.environ.get("OPA_DB_POOL_MIN", 1)),
+                                           int(os.environ.get("OPA_DB_POOL_MAX", 8)), **db_params())
+        return _pool
+
+
+def close_pool():
+    # Closes all the connections of the pool, the next get_pool creates a new one
+    global _pool
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+
+
+@contextmanager
+def connection():
+    """
+    Lends a connection of the pool for one transaction.
+
+    The transaction is committed when the block ends and rolled back if it raises, then the connection goes
+    back to the pool (a connection closed by the server is discarded).
+    """
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def _column_kinds(description):
+    return [_OID_KINDS.get(column.type_code, "object") for column in description]
+
+
+def _convert(values, kind):
+    # Converts the values of one column of a chunk, returns the data and the mask of the NULLs (or None)
+    if kind == "float":
+        return np.array(values, dtype=np.float64), None
+    if kind in ("int", "bool"):
+        objects = np.array(values, dtype=object)
+        mask = np.equal(objects, None)
+        return np.where(mask, 0, objects).astype(np.int64 if kind == "int" else bool), mask
+    if kind == "date":
+        return np.array(values, dtype="datetime64[D]").astype("datetime64[ns]"), None
+    if kind == "timestamp":
+        return np.array(values, dtype="datetime64[ns]"), None
+    if kind == "timestamptz":
+        # returned in UTC, without time zone
+        return pd.to_datetime(list(values), utc=True).tz_localize(None).to_numpy(), None
+    if kind == "text":
+        return np.array(values, dtype=object), None
+    objects = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        objects[i] = value
+    return objects, None
+
+
+def _allocate(kind, n):
+    # The arrays receiving a column of n rows, with the mask of the NULLs of the nullable integer types
+    if kind in ("int", "bool"):
+        return np.zeros(n, dtype=np.int64 if kind == "int" else bool), np.zeros(n, dtype=bool)
+    dtype = {"float": np.float64, "date": "datetime64[ns]", "timestamp": "datetime64[ns]",
+             "timestamptz": "datetime64[ns]"}.get(kind, object)
+    return np.empty(n, dtype=dtype), None
+
+
+def _grow(data, mask, n):
+    # Copies a column into arrays of n rows, the rows after the copied ones are left uninitialized
+    grown = np.empty(n, dtype=data.dtype)
+    grown[:len(data)] = data
+    if mask is not None:
+        grown_mask = np.zeros(n, dtype=bool)
+        grown_mask[:len(mask)] = mask
+        mask = grown_mask
+    return grown, mask
+
+
+def _to_series(data, mask, kind):
+    if kind == "int":
+        return pd.arrays.IntegerArray(data, mask)
+    if kind == "bool":
+        return pd.arrays.BooleanArray(data, mask)
+    return data
+
+
+def _fetch_chunks(conn, query, params, chunk_rows):
+    # Runs the query in a named cursor and yields the rows chunk by chunk, with the cursor description.
+    # The first chunk is yielded even when the result is empty, for the description of its columns.
+    with conn.cursor(name=f"stream_{next(_cursor_ids)}") as cursor:
+        cursor.itersize = chunk_rows
+        cursor.execute(query, params)
+        rows = cursor.fetchmany(chunk_rows)
+        yield rows, cursor.description
+        while rows:
+            rows = cursor.fetchmany(chunk_rows)
+            if rows:
+                yield rows, cursor.description
+
+
+def _chunk_frame(rows, description):
+    kinds = _column_kinds(description)
+    columns = {}
+    for column, values, kind in zip(description, zip(*rows), kinds):
+        data, mask = _convert(values, kind)
+        columns[column.name] = _to_series(data, mask, kind)
+    return pd.DataFrame(columns)
+
+
+def stream_query(query, params=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Runs a query through a server-side cursor and yields its result as typed DataFrames.
+
+    The connection is held until the generator is exhausted or closed.
+
+    Args:
+        query (str or psycopg2.sql.Composable): The SELECT query.
+        params: The parameters of the query.
+        chunk_rows (int): The number of rows of each DataFrame.
+
+    Yields:
+        pandas.DataFrame: The next chunk_rows rows of the result.
+    """
+    with connection() as conn:
+        for rows, description in _fetch_chunks(conn, query, params, chunk_rows):
+            if rows:
+                yield _chunk_frame(rows, description)
+
+
+def read_frame(query, params=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Reads the result of a query into a single DataFrame.
+
+    Each chunk sent by the server-side cursor is copied into typed arrays, which double in size when they are
+    full: the peak memory stays within a few times the final frame, instead of all the chunks (as tuples)
+    and their concatenation.
+
+    Args:
+        query (str or psycopg2.sql.Composable): The SELECT query.
+        params: The parameters of the query.
+        chunk_rows (int): The number of rows fetched at a time.
+
+    Returns:
+        pandas.DataFrame: The result, with the columns of the query (and their types) even if there is no row.
+    """
+    if isinstance(query, str):
+        query = sql.SQL(query)
+    names, kinds, arrays, position = None, None, None, 0
+    with connection() as conn:
+        for rows, description in _fetch_chunks(conn, query, params, chunk_rows):
+            if arrays is None:
+                names = [column.name for column in description]
+                kinds = _column_kinds(description)
+                arrays = [_allocate(kind, len(rows)) for kind in kinds]
+            end = position + len(rows)
+            capacity = len(arrays[0][0]) if arrays else end
+            if end > capacity:
+                arrays = [_grow(data, mask, max(end, 2 * capacity)) for data, mask in arrays]
+            for (data, mask), values, kind in zip(arrays, zip(*rows), kinds):
+                chunk_data, chunk_mask = _convert(values, kind)
+                data[position:end] = chunk_data
+                if mask is not None:
+                    mask[position:end] = chunk_mask
+            position = end
+
+    return pd.DataFrame({name: _to_series(data[:position], None if mask is None else mask[:position], kind)
+                         for name, (data, mask), kind in zip(names, arrays, kinds)})
+
+
+def rates_query(columns=None, tickers=None, start=None, end=None, table=RATES_TABLE):
+    """
+    Builds the query of the daily rates, with the filters pushed down to the database.
+
+    Only the requested columns are read, the ticker filter uses the primary key (ticker, date) and the date
+    range only scans the partitions it overlaps.
+
+    Args:
+        columns (list): The columns to read, all the columns of RATES_COLUMNS by default.
+        tickers (str or list): The tickers to read (e.g. "btc-usd"), all of them by default.
+        start, end: The first and the last dates to read (included), anything pandas.Timestamp accepts.
+        table (str): The table of the rates.
+
+    Returns:
+        tuple: The query (psycopg2.sql.Composed) and its parameters, sorted by ticker and date.
+    """
+    columns = list(columns or RATES_COLUMNS)
+    unknown = set(columns) - set(RATES_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown columns {sorted(unknown)}, the columns are {RATES_COLUMNS}")
+    conditions, params = [], []
+    if tickers is not None:
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        conditions.append(sql.SQL("ticker = ANY(%s)"))
+        params.append([ticker.lower() for ticker in tickers])
+    if start is not None:
+        conditions.append(sql.SQL("date >= %s"))
+        params.append(pd.Timestamp(start).date())
+    if end is not None:
+        conditions.append(sql.SQL("date <= %s"))
+        params.append(pd.Timestamp(end).date())
+    where = sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+    query = sql.SQL("SELECT {columns} FROM {table}{where} ORDER BY ticker, date").format(
+        columns=sql.SQL(", ").join(map(sql.Identifier, columns)), table=sql.Identifier(table), where=where)
+    return query, params
+
+
+def read_rates(columns=None, tickers=None, start=None, end=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    # The daily rates as a single DataFrame, see rates_query for the filters
+    query, params = rates_query(columns, tickers, start, end)
+    return read_frame(query, params, chunk_rows)
+
+
+def iter_rates(columns=None, tickers=None, start=None, end=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+    # The daily rates as DataFrames of chunk_rows rows, see rates_query for the filters
+    query, params = rates_query(columns, tickers, start, end)
+    return stream_query(query, params, chunk_rows)
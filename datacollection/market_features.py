@@ -0,0 +1,89 @@
+"""
+Refresh and reads of the market_features table (see sql/create_market_features).
+
+The table holds the daily crypto rates joined with the market indices, forward-filled across the days the
+markets are closed. refresh() writes the dates from the latest refreshed one minus lookback_days and the new
+tickers, so it can run after every load of datacollection/crypto_rates_daily.py. Older rates corrected in
+the source tables are not picked up: run it with MARKET_FEATURES_FULL=1 to rebuild the whole history.
+
+Example:
+    from market_features import read_features
+    df = read_features(start="2022-01-01", tickers=["btc-usd"])
+"""
+import os
+import time
+
+import pandas as pd
+from psycopg2 import sql
+
+import db_access
+
+# initializing Parameters
+lookback_days = 7           # refreshed days before the latest refreshed date, for the late candles and index rates
+full_refresh = False        # rebuild the whole history instead
+
+table_name = "market_features"
+schema_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql", "create_market_features")
+
+
+def schema_ensure(cursor):
+    # Creates the table, its indexes and the refresh function if needed
+    with open(schema_file) as file:
+        cursor.execute(file.read())
+
+
+def refresh(lookback_days=lookback_days, full_refresh=full_refresh):
+    """
+    Refreshes the market_features table, in a single transaction.
+
+    Returns:
+        int: The number of rows written.
+    """
+    with db_access.connection() as connection:
+        with connection.cursor() as cursor:
+            schema_ensure(cursor)
+            cursor.execute("SELECT refresh_market_features(%s, %s)", (lookback_days, full_refresh))
+            written = cursor.fetchone()[0]
+            if full_refresh:
+                cursor.execute(f"ANALYZE {table_name}")
+    return written
+
+
+def read_features(columns=None, tickers=None, start=None, end=None, chunk_rows=db_access.DEFAULT_CHUNK_ROWS):
+    """
+    Reads the market features, sorted by date and ticker.
+
+    The date range is a range scan of the primary key (date, ticker), the ticker filter uses the
+    (ticker, date) index.
+
+    Args:
+        columns (list): The columns to read, all of them by default.
+        tickers (str or list): The tickers to read (e.g. "btc-usd"), all of them by default.
+        start, end: The first and the last dates to read (included), anything pandas.Timestamp accepts.
+
+    Returns:
+        pandas.DataFrame: The features.
+    """
+    conditions, params = [], []
+    if tickers is not None:
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        conditions.append(sql.SQL("ticker = ANY(%s)"))
+        params.append([ticker.lower() for ticker in tickers])
+    if start is not None:
+        conditions.append(sql.SQL("date >= %s"))
+        params.append(pd.Timestamp(start).date())
+    if end is not None:
+        conditions.append(sql.SQL("date <= %s"))
+        params.append(pd.Timestamp(end).date())
+    selected = sql.SQL(", ").join(map(sql.Identifier, columns)) if columns else sql.SQL("*")
+    where = sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+    query = sql.SQL("SELECT {columns} FROM {table}{where} ORDER BY date, ticker").format(
+        columns=selected, table=sql.Identifier(table_name), where=where)
+    return db_access.read_frame(query, params, chunk_rows)
+
+
+if __name__ == "__main__":
+    start = time.perf_counter()
+    written = refresh(full_refresh=full_refresh or os.environ.get("MARKET_FEATURES_FULL") == "1")
+    print(f"{written} rows of {table_name} refreshed in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,243 @@
+"""
+Local Parquet snapshots of the database tables, for the offline model training.
+
+export_table() copies a table with the columns date and ticker (crypto_daily_rates_hist, market_features)
+into a Parquet dataset partitioned by ticker and month, e.g.
+'Parquet_Store/crypto_daily_rates_hist/ticker=btc-usd/month=2023-08/part-0.parquet'. The files keep the
+types of the table (date32 dates, float64 prices, int64 volumes). A manifest records the row count and the
+latest date of each exported partition; a run only downloads the partitions that are new or changed, plus
+the last lookback_months months, whose candles can still be updated.
+
+load_rates() reads the dataset back with pyarrow: only the requested columns are read, and the ticker and
+date filters skip the partition directories and the row groups (by their statistics) they exclude.
+
+Example:
+    from parquet_export import export_table, load_rates
+    export_table()
+    df_btc = load_rates(tickers=["btc-usd"], columns=["date", "close", "volume"])
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from psycopg2 import sql
+
+import db_access
+
+# initializing Parameters
+root_dir = "Parquet_Store"  # the directory of the datasets, one per table
+lookback_months = 1         # months before the current one exported again on every run
+max_workers = 4             # number of tickers exported at the same time
+row_group_size = 8192       # rows per row group, the unit skipped by the date filters
+
+# The hive partitions of the datasets, both kept as strings
+PARTITIONING = ds.partitioning(pa.schema([("ticker", pa.string()), ("month", pa.string())]), flavor="hive")
+
+
+def _table_dir(table, root=root_dir):
+    return os.path.join(root, table)
+
+
+def _read_manifest(table, root=root_dir):
+    path = os.path.join(_table_dir(table, root), "_manifest.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def _write_manifest(table, manifest, root=root_dir):
+    path = os.path.join(_table_dir(table, root), "_manifest.json")
+    # Write to a temporary file first so that an interrupted run never leaves a truncated file
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def partition_inventory(table, tickers=None):
+    """
+    Lists the (ticker, month) partitions of a table, with their row count and latest date.
+
+    Returns:
+        pandas.DataFrame: The columns ticker, month ('YYYY-MM'), rows and last_date.
+    """
+    where, params = sql.SQL(""), None
+    if tickers is not None:
+        where, params = sql.SQL(" WHERE ticker = ANY(%s)"), [[ticker.lower() for ticker in tickers]]
+    query = sql.SQL("""SELECT ticker, to_char(date, 'YYYY-MM') AS month, count(*) AS rows, max(date) AS last_date
+                       FROM {table}{where} GROUP BY 1, 2""").format(table=sql.Identifier(table), where=where)
+    return db_access.read_frame(query, params)
+
+
+def _to_arrow(df):
+    # The dates are stored as date32, the text as strings (even when a month has only NULLs),
+    # the other columns keep the types of the table
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if field.name == "date":
+            table = table.set_column(i, field.name, table[field.name].cast(pa.date32()))
+        elif pd.api.types.is_object_dtype(df[field.name].dtype) or pd.api.types.is_string_dtype(df[field.name].dtype):
+            table = table.set_column(i, field.name, table[field.name].cast(pa.string()))
+    return table
+
+
+def _write_partition(table, ticker, month, df, root=root_dir):
+    month_dir = os.path.join(_table_dir(table, root), f"ticker={ticker}", f"month={month}")
+    os.makedirs(month_dir, exist_ok=True)
+    path = os.path.join(month_dir, "part-0.parquet")
+    # the dataset reader ignores the files starting with a dot
+    tmp_path = os.path.join(month_dir, f".part-0.{uuid.uuid4().hex}.tmp")
+    pq.write_table(_to_arrow(df), tmp_path, row_group_size=row_group_size)
+    os.replace(tmp_path, path)
+
+
+def _delete_partition(table, ticker, month, root=root_dir):
+    ticker_dir = os.path.join(_table_dir(table, root), f"ticker={ticker}")
+    shutil.rmtree(os.path.join(ticker_dir, f"month={month}"), ignore_errors=True)
+    if os.path.isdir(ticker_dir) and not os.listdir(ticker_dir):
+        os.rmdir(ticker_dir)
+
+
+def _month_spans(months):
+    # Splits the months into runs of consecutive months, as (first, last) periods
+    periods = sorted(pd.Period(month, "M") for month in months)
+    spans = [[periods[0], periods[0]]]
+    for period in periods[1:]:
+        if period == spans[-1][1] + 1:
+            spans[-1][1] = period
+        else:
+            spans.append([period, period])
+    return spans
+
+
+def _export_ticker(table, ticker, months, root=root_dir):
+    # Downloads the months of a ticker with one range query per run of consecutive months,
+    # and writes one file per month
+    query = sql.SQL("SELECT * FROM {table} WHERE ticker = %s AND date >= %s AND date < %s ORDER BY date").format(
+        table=sql.Identifier(table))
+    exported = {}
+    for first, last in _month_spans(months):
+        df = db_access.read_frame(query, [ticker, first.start_time.date(), (last + 1).start_time.date()])
+        if df.empty:
+            continue
+        for month, df_month in df.groupby(df["date"].dt.strftime("%Y-%m").values, sort=False):
+            _write_partition(table, ticker, month, df_month.drop(columns="ticker"), root)
+            exported[f"{ticker}/{month}"] = {"rows": len(df_month),
+                                             "last_date": str(df_month["date"].max().date())}
+    return exported
+
+
+def export_table(table=db_access.RATES_TABLE, root=root_dir, tickers=None, lookback_months=lookback_months,
+                 workers=max_workers):
+    """
+    Exports the new and changed (ticker, month) partitions of a table to its Parquet dataset.
+
+    A partition is exported when it is not in the manifest, when its row count or latest date changed
+    in the database, or when it is one of the last lookback_months months. When all the tickers are exported,
+    the partitions whose rows were deleted from the database are deleted from the dataset as well.
+
+    Args:
+        table (str): The table, with the columns date and ticker.
+        root (str): The directory of the datasets.
+        tickers (list): The tickers to export, all of them by default.
+        lookback_months (int): The number of months before the current one always exported.
+        workers (int): The number of tickers exported at the same time.
+
+    Returns:
+        dict: The number of partitions "written", "skipped" and "deleted".
+    """
+    os.makedirs(_table_dir(table, root), exist_ok=True)
+    manifest = _read_manifest(table, root)
+    inventory = partition_inventory(table, tickers)
+    recent = (pd.Timestamp.today().to_period("M") - lookback_months).strftime("%Y-%m")
+
+    # The partitions no longer in the table, only known when the inventory covers all the tickers
+    deleted = []
+    if tickers is None:
+        # an empty table leaves nothing in the dataset
+        current = set() if inventory.empty else set(inventory["ticker"] + "/" + inventory["month"])
+        deleted = [key for key in manifest if key not in current]
+        for key in deleted:
+            _delete_partition(table, *key.rsplit("/", 1), root=root)
+            del manifest[key]
+        if deleted:
+            _write_manifest(table, manifest, root)
+
+    todo = {}
+    for row in inventory.itertuples(index=False):
+        stored = manifest.get(f"{row.ticker}/{row.month}")
+        changed = (stored is None or stored["rows"] != row.rows
+                   or stored["last_date"] != str(pd.Timestamp(row.last_date).date()))
+        if changed or row.month >= recent:
+            todo.setdefault(row.ticker, set()).add(row.month)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_export_ticker, table, ticker, months, root) for ticker, months in todo.items()]
+        # the manifest is only updated by this thread, and saved after each ticker:
+        # an interrupted run keeps the partitions already written
+        for future in as_completed(futures):
+            manifest.update(future.result())
+            _write_manifest(table, manifest, root)
+
+    written = sum(len(months) for months in todo.values())
+    return {"written": written, "skipped": len(inventory) - written, "deleted": len(deleted)}
+
+
+def load_rates(columns=None, tickers=None, start=None, end=None, table=db_access.RATES_TABLE, root=root_dir):
+    """
+    Reads an exported table from its Parquet dataset.
+
+    Args:
+        columns (list): The columns to read, all of them by default.
+        tickers (str or list): The tickers to read (e.g. "btc-usd"), all of them by default.
+        start, end: The first and the last dates to read (included), anything pandas.Timestamp accepts.
+        table (str): The exported table.
+        root (str): The directory of the datasets.
+
+    Returns:
+        pandas.DataFrame: The rows sorted by ticker and date, with datetime64 dates and nullable integers.
+    """
+    dataset = ds.dataset(_table_dir(table, root), format="parquet", partitioning=PARTITIONING)
+    conditions = []
+    if tickers is not None:
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        conditions.append(ds.field("ticker").isin([ticker.lower() for ticker in tickers]))
+    if start is not None:
+        start = pd.Timestamp(start)
+        # the month directories are skipped from their name, the rows of the first month from the statistics
+        conditions.append(ds.field("month") >= start.strftime("%Y-%m"))
+        conditions.append(ds.field("date") >= start.date())
+    if end is not None:
+        end = pd.Timestamp(end)
+        conditions.append(ds.field("month") <= end.strftime("%Y-%m"))
+        conditions.append(ds.field("date") <= end.date())
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    if columns is None:
+        columns = [name for name in dataset.schema.names if name != "month"]
+    arrow_table = dataset.to_table(columns=list(columns), filter=expression)
+    df = arrow_table.to_pandas(date_as_object=False,
+                               types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+    keys = [key for key in ("ticker", "date") if key in df.columns]
+    if keys:
+        df = df.sort_values(keys, kind="stable", ignore_index=True)
+    return df
+
+
+if __name__ == "__main__":
+    for table in (db_access.RATES_TABLE, "market_features"):
+        start = time.perf_counter()
+        report = export_table(table)
+        print(f"{table}: {report['written']} partitions written, {report['skipped']} up to date, "
+              f"{report['deleted']} deleted, {time.perf_counter() - start:.1f} s")